@@ -1,31 +1,171 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from flask import Flask, render_template, send_file, request, redirect, url_for, jsonify, g, flash, send_from_directory, current_app, Response
+from flask import Flask, has_request_context, render_template, send_file, request, redirect, url_for, jsonify, g, flash, send_from_directory, current_app, Response, make_response
 from flask_mail import Mail, Message
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_httpauth import HTTPBasicAuth
-from html import unescape
-from urllib.parse import urlparse, unquote
+from limits.storage import SlidingWindowCounterSupport, Storage
+from limits.storage.base import TimestampedSlidingWindow
+from html import escape, unescape
+from PIL import Image, ImageOps
+from urllib.parse import urlencode, urlparse, unquote, quote
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
+import atexit
+import base64
+import bisect
+import click
+import fcntl
+import hashlib
 import json
 import logging
+import logging.handlers
 import markdown
+import math
+import mimetypes
+import mmap
 import os
-import random
+import queue
 import re
+import shutil
+import smtplib
 import sqlite3
+import stat
 import sys
+import tempfile
+import threading
+import time
 import xml.etree.ElementTree as ET
+import zlib
 
 # Configure logging BEFORE anything of substance
+# Request threads only put records on a queue, a listener thread formats and
+# writes them: JSON lines to a size rotated italy.log and plain text to stdout.
+# Chatty routes are sampled, see LOG_SAMPLED_ROUTES.
+LOG_FILE = "italy.log"
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))   # Rotate italy.log at this size
+LOG_BACKUPS = int(os.environ.get('LOG_BACKUPS', 5))                 # Rotated files kept
+LOG_SAMPLE_WINDOW = 10                                              # Seconds per sampling window
+LOG_SAMPLED_ROUTES = {                                              # Endpoint -> INFO lines kept per window
+    'serveContent': 20,
+    'serveDerivative': 20
+}
+
+class JsonLogFormatter(logging.Formatter):
+    # Format a record as one JSON line, the level prefix of the message is dropped.
+    # Tracebacks are already part of the message, the queue handler formats them in.
+    def format(self, record):
+        message = re.sub(r'^\[[A-Z]+\] ', '', record.getMessage())
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'message': message,
+            'pid': record.process
+        }
+        for key in ('endpoint', 'path', 'suppressed'):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+class SharedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    # Every gunicorn worker writes italy.log. Writes and rollover take a lock on a file
+    # shared by the processes, so only one of them rotates, and a rotation done by
+    # another process is followed by reopening the log
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.lockFilename = self.baseFilename + '.lock'
+        self.lockFile = None
+        self.lockPid = None
+
+    def reopenIfRotated(self):
+        # Close the stream if italy.log is no longer the file it writes to
+        if self.stream is None:
+            return
+        try:
+            if os.stat(self.baseFilename).st_ino == os.fstat(self.stream.fileno()).st_ino:
+                return
+        except OSError:
+            pass
+        self.stream.close()
+        self.stream = None
+
+    def emit(self, record):
+        try:
+            if self.lockPid != os.getpid():
+                if self.lockFile is not None:
+                    self.lockFile.close()
+                self.lockFile = open(self.lockFilename, 'a')        # flock belongs to the open file, so one per process
+                self.lockPid = os.getpid()
+            fcntl.flock(self.lockFile, fcntl.LOCK_EX)
+        except OSError:
+            self.handleError(record)
+            return
+        try:
+            self.reopenIfRotated()
+            if self.shouldRollover(record):
+                self.doRollover()
+            logging.FileHandler.emit(self, record)
+        except Exception:
+            self.handleError(record)
+        finally:
+            fcntl.flock(self.lockFile, fcntl.LOCK_UN)
+
+class RequestLogFilter(logging.Filter):
+    # Runs in the request thread: tag records with the request and sample the chatty routes
+    def __init__(self):
+        super().__init__()
+        self.windows = {}                                           # Endpoint -> [window start, lines, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not has_request_context():
+            return True
+        record.endpoint = request.endpoint
+        record.path = request.path
+        limit = LOG_SAMPLED_ROUTES.get(request.endpoint)
+        if limit is None or record.levelno > logging.INFO:
+            return True
+
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.setdefault(request.endpoint, [now, 0, 0])
+            if now - window[0] >= LOG_SAMPLE_WINDOW:
+                if window[2]:
+                    record.suppressed = window[2]
+                    record.msg = f"{record.msg} ({window[2]} similar lines suppressed)"
+                window[:] = [now, 0, 0]
+            if window[1] >= limit:
+                window[2] += 1
+                return False
+            window[1] += 1
+        return True
+
+def startLogListener():
+    # Start the thread writing queued records, again on a fresh queue in each forked worker,
+    # so records still queued in the parent at fork time are not written twice
+    global logListener
+    logQueueHandler.queue = queue.SimpleQueue()
+    logListener = logging.handlers.QueueListener(logQueueHandler.queue, *logHandlers, respect_handler_level=True)
+    logListener.start()
+
+logFileHandler = SharedRotatingFileHandler(LOG_FILE, mode="a", maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+logFileHandler.setFormatter(JsonLogFormatter())
+logStreamHandler = logging.StreamHandler(sys.stdout)
+logStreamHandler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+logHandlers = [logFileHandler, logStreamHandler]
+logQueueHandler = logging.handlers.QueueHandler(queue.SimpleQueue())
+logQueueHandler.setFormatter(logging.Formatter("%(message)s"))
+logQueueHandler.addFilter(RequestLogFilter())
 logging.basicConfig(
     level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("italy.log", mode="a"),
-        logging.StreamHandler(sys.stdout)
-    ]
+    handlers=[logQueueHandler]
 )
+startLogListener()
+os.register_at_fork(after_in_child=startLogListener)
+atexit.register(lambda: logListener.stop())
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -40,15 +180,149 @@ app = Flask(__name__)
 app.config['CONTENT_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'content')
 app.config['IMAGES_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'images')
 app.config['DATADB'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'data.db')
+app.config['METADATADB'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'metadata.db')
+app.config['DERIVATIVES_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'derivatives')
+app.config['DERIVATIVE_WIDTHS'] = [320, 640, 1280]
+app.config['DERIVATIVES_MAX_BYTES'] = int(os.environ.get('DERIVATIVES_MAX_BYTES', 2 * 1024 ** 3))
+app.config['COVER_ROTATION'] = os.environ.get('COVER_ROTATION', 'daily')          # 'daily' or 'fixed'
+app.config['PAGE_CACHE_SIZE'] = int(os.environ.get('PAGE_CACHE_SIZE', 512))      # Rendered pages kept per worker
+app.config['PAGE_CACHE_FOLDER'] = os.environ.get('PAGE_CACHE_FOLDER')               # Optional cache shared by all workers
+app.config['PAGE_CACHE_MAX_BYTES'] = int(os.environ.get('PAGE_CACHE_MAX_BYTES', 256 * 1024 ** 2))   # Size cap of PAGE_CACHE_FOLDER
+app.config['METRICS_FOLDER'] = os.environ.get('METRICS_FOLDER')                     # Optional, merges the metrics of all workers
+app.config['CONTENT_DELIVERY'] = os.environ.get('CONTENT_DELIVERY', 'direct')     # 'direct', 'x-accel' or 'x-sendfile'
+app.config['CONTENT_ACCEL_PREFIX'] = os.environ.get('CONTENT_ACCEL_PREFIX', '/protected-content/')   # nginx internal location
+app.config['IMAGES_MAX_AGE'] = int(os.environ.get('IMAGES_MAX_AGE', 86400))       # Seconds browsers may cache blog images
+app.config['CONTENT_INDEX_TTL'] = int(os.environ.get('CONTENT_INDEX_TTL', 5))   # Seconds between content mtime checks
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
 app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
-app.config['MAIL_USE_TLS'] = True
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'   # Off for a local SMTP sink
 app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER')
+app.config['MAIL_SENDER_THREAD'] = os.environ.get('MAIL_SENDER_THREAD', 'true').lower() == 'true'   # Off when only flask send-mail delivers
+app.config['RATELIMIT_STORAGE_URI'] = os.environ.get('RATELIMIT_STORAGE_URI',       # Shared by all workers, memory:// counts per worker
+    'sqlite://' + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'limits.db'))
 appTitle = "Visit Italy!";
 postsPerPage = 10
+commentsPerPage = 20
+commentsPageLimit = 100
+
+# ##########################################################
+# Rate limit storage
+# ##########################################################
+# memory:// counts in each gunicorn worker, so a limit really allowed workers
+# times as many hits. sqlite:///path/limits.db keeps the counters in one WAL
+# file shared by every worker on the box. Each hit is a single upsert in
+# autocommit mode; the counters are not worth an fsync, so synchronous is off.
+# Registering the sqlite scheme with limits happens by subclassing Storage.
+LIMITS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS limits (
+        key TEXT PRIMARY KEY,
+        count INTEGER NOT NULL,
+        expires REAL NOT NULL
+    ) WITHOUT ROWID
+"""
+LIMITS_PURGE_INTERVAL = 60                                          # Seconds between deletes of expired counters
+
+class SQLiteLimiterStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    # Fixed window and sliding window counter storage for flask-limiter in a SQLite file
+    # Written against the limits 5 storage API (see requirements.txt)
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        self.path = uri[len('sqlite://'):]
+        self.local = threading.local()
+        self.purged = 0.0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def connection(self):
+        # This thread's connection, reopened in a forked child
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+            conn.execute(LIMITS_SCHEMA)
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def incr(self, key, expiry, amount=1):
+        # Add to a counter, starting it over once its window expired
+        now = time.time()
+        conn = self.connection()
+        if now - self.purged > LIMITS_PURGE_INTERVAL:
+            self.purged = now
+            conn.execute("DELETE FROM limits WHERE expires <= ?", (now,))
+        return conn.execute("""
+            INSERT INTO limits (key, count, expires) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                count = CASE WHEN expires <= ?4 THEN excluded.count ELSE count + excluded.count END,
+                expires = CASE WHEN expires <= ?4 THEN excluded.expires ELSE expires END
+            RETURNING count
+        """, (key, amount, now + expiry, now)).fetchone()[0]
+
+    def decr(self, key, amount=1):
+        row = self.connection().execute("""
+            UPDATE limits SET count = max(count - ?, 0)
+            WHERE key = ? AND expires > ?
+            RETURNING count
+        """, (amount, key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get(self, key):
+        row = self.connection().execute("SELECT count FROM limits WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self.connection().execute("SELECT expires FROM limits WHERE key = ? AND expires > ?", (key, now)).fetchone()
+        return row[0] if row else now
+
+    def clear(self, key):
+        self.connection().execute("DELETE FROM limits WHERE key = ?", (key,))
+
+    def check(self):
+        try:
+            self.connection().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self.connection().execute("DELETE FROM limits").rowcount
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        # Same weighting as memory://, the increment is undone when another worker won the race
+        if amount > limit:
+            return False
+        previousCount, previousTtl, currentCount, _ = self.get_sliding_window(key, expiry)
+        if math.floor(previousCount * previousTtl / expiry + currentCount) + amount > limit:
+            return False
+        previousKey, currentKey = self.sliding_window_keys(key, expiry, time.time())
+        currentCount = self.incr(currentKey, 2 * expiry, amount)
+        if math.floor(previousCount * previousTtl / expiry + currentCount) > limit:
+            self.decr(currentKey, amount)
+            return False
+        return True
+
+    def get_sliding_window(self, key, expiry):
+        now = time.time()
+        previousKey, currentKey = self.sliding_window_keys(key, expiry, now)
+        previousCount = self.get(previousKey)
+        previousTtl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previousCount else 0.0
+        currentTtl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previousCount, previousTtl, self.get(currentKey), currentTtl
+
+    def clear_sliding_window(self, key, expiry):
+        for windowKey in self.sliding_window_keys(key, expiry, time.time()):
+            self.clear(windowKey)
 
 # ##########################################################
 # Initialize extensions
@@ -57,7 +331,7 @@ mail = Mail(app)
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=[],
-    storage_uri="memory://"
+    storage_uri=app.config['RATELIMIT_STORAGE_URI']
 )
 limiter.init_app(app)
 auth = HTTPBasicAuth()
@@ -111,11 +385,10 @@ def saveContact(data, ip_address, user_agent):
         data['firstName'], data['lastName'], data['email'],
         data.get('phone', ''), data['subject'],
         data.get('company', ''), data.get('image', ''),
-        data['message'], 'newsLetter' in data, ipAddress, userAgent
+        data['message'], 'newsLetter' in data, ip_address, user_agent
     ))
     conn.commit()
     contact_id = cursor.lastrowid
-    conn.close()
     return contact_id
 
 def validateEmail(email):
@@ -135,14 +408,24 @@ def sanitizeInput(text):
 # ##########################################################
 @app.route("/getdb")
 def getdb():
-    return send_file(app.config['DATADB'], as_attachment=True)
+    # Send a consistent snapshot, the file alone misses commits still in the WAL
+    fd, snapshotPath = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        snapshot = sqlite3.connect(snapshotPath)
+        getDataDB().backup(snapshot)
+        snapshot.close()
+        snapshotFile = open(snapshotPath, 'rb')
+    finally:
+        os.remove(snapshotPath)                                     # The open file stays readable until sent
+    return send_file(snapshotFile, as_attachment=True, download_name=os.path.basename(app.config['DATADB']))
 
 # ##########################################################
 # Get Logs
 # ##########################################################
 @app.route("/getlogs")
 def getlogs():
-    return send_file("italy.log", as_attachment=True)
+    return send_file(LOG_FILE, as_attachment=True)
 
 # ##########################################################
 # Privacy Notice processing application route
@@ -154,18 +437,10 @@ def privacy():
 # ##########################################################
 # About processing application route
 # ##########################################################
-@app.route('/about')
-@app.route('/about/<path:from_path>')
-def about(from_path=None):
-    # Build breadcrumbs for the about page
-    breadcrumbs = []
-
-    if from_path:
-        # User came from a specific folder - preserve that path
-        # Use the existing build_hierarchical_metadata function to get the full path
-        folder_metadata = build_hierarchical_metadata(from_path)
-        breadcrumbs = folder_metadata['breadcrumbs'].copy()
-    else:
+def getReferrerBreadcrumbs(from_path):
+    # Breadcrumbs of the folder the visitor came from, given in the URL or
+    # taken from ?from= or the Referer, or just Home
+    if not from_path:
         # Check if there's a referrer path in the request args or session
         referrer_path = request.args.get('from') or request.referrer
         if referrer_path and referrer_path != request.url:
@@ -173,15 +448,20 @@ def about(from_path=None):
             try:
                 parsed = urlparse(referrer_path)
                 if '/folder/' in parsed.path:
-                    folder_path = unquote(parsed.path.replace('/folder/', ''))
-                    folder_metadata = build_hierarchical_metadata(folder_path)
-                    breadcrumbs = folder_metadata['breadcrumbs'].copy()
-            except:
+                    from_path = unquote(parsed.path.replace('/folder/', ''))
+            except ValueError:
                 pass
 
+    if from_path:
+        return build_hierarchical_metadata(from_path)['breadcrumbs'].copy()
     # If no specific path context, just use home
-    if not breadcrumbs:
-        breadcrumbs = [{'name': 'Home', 'path': ''}]
+    return [{'name': 'Home', 'path': ''}]
+
+@app.route('/about')
+@app.route('/about/<path:from_path>')
+def about(from_path=None):
+    # Build breadcrumbs for the about page
+    breadcrumbs = getReferrerBreadcrumbs(from_path)
 
     # Add the About breadcrumb as the final item
     breadcrumbs.append({'name': 'About', 'path': 'about'})
@@ -223,30 +503,7 @@ def about(from_path=None):
 @app.route('/contact/<path:from_path>')
 def contact(from_path=None):
     # Build breadcrumbs for the contact page
-    breadcrumbs = []
-
-    if from_path:
-        # User came from a specific folder - preserve that path
-        # Use the existing build_hierarchical_metadata function to get the full path
-        folder_metadata = build_hierarchical_metadata(from_path)
-        breadcrumbs = folder_metadata['breadcrumbs'].copy()
-    else:
-        # Check if there's a referrer path in the request args or session
-        referrer_path = request.args.get('from') or request.referrer
-        if referrer_path and referrer_path != request.url:
-            # Try to extract folder path from referrer URL
-            try:
-                parsed = urlparse(referrer_path)
-                if '/folder/' in parsed.path:
-                    folder_path = unquote(parsed.path.replace('/folder/', ''))
-                    folder_metadata = build_hierarchical_metadata(folder_path)
-                    breadcrumbs = folder_metadata['breadcrumbs'].copy()
-            except:
-                pass
-
-    # If no specific path context, just use home
-    if not breadcrumbs:
-        breadcrumbs = [{'name': 'Home', 'path': ''}]
+    breadcrumbs = getReferrerBreadcrumbs(from_path)
 
     # Add the contact breadcrumb as the final item
     breadcrumbs.append({'name': 'Contact', 'path': 'contact'})
@@ -322,10 +579,10 @@ def contactFormSubmission():
         # Save to database
         contact_id = saveContact(data, ip_address, user_agent)
 
-        # Send email notification
+        # Queue email notification, the mail sender delivers it in the background
         sendNotificationEmail(data, contact_id)
 
-        # Send confirmation email to user
+        # Queue confirmation email to user
         sendConfirmationEmail(data)
 
         logger.info(f"Contact form submitted successfully. ID: {contact_id}")
@@ -344,7 +601,7 @@ def contactFormSubmission():
         }), 500
 
 def sendNotificationEmail(data, contact_id):
-    # Send notification eMail to admin
+    # Queue notification eMail to admin
     try:
         subject = f"New Contact Form Submission - {data['subject']} (#{contact_id})"
 
@@ -372,18 +629,13 @@ def sendNotificationEmail(data, contact_id):
         This is an automated message from your website contact form.
         """
 
-        msg = Message(
-            subject=subject,
-            recipients=[os.environ.get('ADMIN_EMAIL', 'admin@yoursite.com')],
-            body=body
-        )
-        mail.send(msg)
+        queueMail(subject, [os.environ.get('ADMIN_EMAIL', 'admin@yoursite.com')], body)
 
     except Exception as e:
-        logger.error(f"Failed to send notification email: {str(e)}")
+        logger.error(f"Failed to queue notification email: {str(e)}")
 
 def sendConfirmationEmail(data):
-    # Send confirmation email to user
+    # Queue confirmation email to user
     try:
         subject = "Thank you for contacting us"
 
@@ -405,15 +657,140 @@ def sendConfirmationEmail(data):
         This is an automated confirmation email. Please do not reply to this message.
         """
 
-        msg = Message(
-            subject=subject,
-            recipients=[data['email']],
-            body=body
-        )
-        mail.send(msg)
+        queueMail(subject, [data['email']], body)
 
     except Exception as e:
-        logger.error(f"Failed to send confirmation email: {str(e)}")
+        logger.error(f"Failed to queue confirmation email: {str(e)}")
+
+# ##########################################################
+# Mail outbox functions
+# ##########################################################
+# Contact form mail is written to the mailOutbox table and delivered by a
+# sender thread in each worker, so a slow SMTP server never holds a request.
+# A batch is claimed by pushing its nextAttempt past a lease in one UPDATE,
+# so workers never send the same mail twice, and mail a crashed sender had
+# claimed is retried once the lease runs out. Failures back off exponentially.
+MAIL_BATCH_SIZE = 20                                                # Messages sent per SMTP connection
+MAIL_LEASE = 300                                                    # Seconds a claimed batch is reserved for its sender
+MAIL_POLL_INTERVAL = 30                                             # Seconds between outbox checks when idle
+MAIL_RETRY_BASE = 60                                                # Seconds before the first retry, doubled each time
+MAIL_RETRY_MAX = 6 * 3600                                           # Longest wait between retries
+MAIL_MAX_ATTEMPTS = 10                                              # Attempts before a message is given up
+MAIL_KEEP_DAYS = 30                                                 # Days sent messages stay in the outbox
+MAIL_OUTBOX_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS mailOutbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        recipients TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        body TEXT NOT NULL,
+        created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        nextAttempt REAL NOT NULL,
+        sent TIMESTAMP,
+        lastError TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS mailOutboxPending ON mailOutbox(nextAttempt) WHERE sent IS NULL"
+]
+mailSenderState = {'pid': None, 'wake': threading.Event()}
+mailSenderLock = threading.Lock()
+
+def queueMail(subject, recipients, body):
+    # Add a message to the outbox and wake this worker's sender
+    conn = getDataDB()
+    conn.execute("""
+        INSERT INTO mailOutbox (recipients, subject, body, nextAttempt)
+        VALUES (?, ?, ?, ?)
+    """, (json.dumps(recipients), subject, body, time.time()))
+    conn.commit()
+    startMailSender()
+    mailSenderState['wake'].set()
+
+def claimMail(limit):
+    # Reserve a batch of due messages for this sender
+    now = time.time()
+    conn = getDataDB()
+    rows = conn.execute("""
+        UPDATE mailOutbox SET nextAttempt = ?, attempts = attempts + 1
+        WHERE id IN (
+            SELECT id FROM mailOutbox
+            WHERE sent IS NULL AND nextAttempt <= ? AND attempts < ?
+            ORDER BY nextAttempt
+            LIMIT ?
+        )
+        RETURNING id, recipients, subject, body, attempts
+    """, (now + MAIL_LEASE, now, MAIL_MAX_ATTEMPTS, limit)).fetchall()
+    conn.commit()
+    return rows
+
+def finishMail(row, error=None):
+    # Mark a claimed message sent, or schedule its retry
+    conn = getDataDB()
+    if error is None:
+        conn.execute("UPDATE mailOutbox SET sent = CURRENT_TIMESTAMP, lastError = NULL WHERE id = ?", (row['id'],))
+    else:
+        delay = min(MAIL_RETRY_BASE * 2 ** (row['attempts'] - 1), MAIL_RETRY_MAX)
+        conn.execute("UPDATE mailOutbox SET nextAttempt = ?, lastError = ? WHERE id = ?",
+                     (time.time() + delay, error, row['id']))
+        if row['attempts'] >= MAIL_MAX_ATTEMPTS:
+            logger.error(f"[ERROR] Mail #{row['id']} given up after {row['attempts']} attempts: {error}")
+        else:
+            logger.error(f"[ERROR] Mail #{row['id']} failed, retry in {delay}s: {error}")
+    conn.commit()
+
+def sendQueuedMail():
+    # Send one batch of due messages over a single SMTP connection, returns the number claimed
+    rows = claimMail(MAIL_BATCH_SIZE)
+    if not rows:
+        return 0
+
+    with app.app_context():
+        pending = list(rows)
+        try:
+            with mail.connect() as connection:
+                while pending:
+                    row = pending[0]
+                    try:
+                        connection.send(Message(subject=row['subject'], recipients=json.loads(row['recipients']), body=row['body']))
+                        finishMail(row)
+                    except smtplib.SMTPRecipientsRefused as e:
+                        finishMail(row, str(e))                     # Only this message is bad, keep the connection
+                    pending.pop(0)
+        except Exception as e:
+            # The connection failed, everything not yet sent backs off
+            for row in pending:
+                finishMail(row, str(e))
+
+    logger.info(f"[INFO] Mail batch: {len(rows) - len(pending)} of {len(rows)} handled")
+    return len(rows)
+
+def mailSenderLoop():
+    # Deliver the outbox until the worker exits
+    conn = getDataDB()
+    while True:
+        try:
+            conn.execute("DELETE FROM mailOutbox WHERE sent < datetime('now', ?)", (f'-{MAIL_KEEP_DAYS} days',))
+            conn.commit()
+            while sendQueuedMail() == MAIL_BATCH_SIZE:
+                pass
+        except Exception as e:
+            logger.error(f"[ERROR] Mail sender failed: {str(e)}")
+        mailSenderState['wake'].wait(MAIL_POLL_INTERVAL)
+        mailSenderState['wake'].clear()
+
+def startMailSender():
+    # Start this worker's mail sender thread, once per process
+    if mailSenderState['pid'] == os.getpid() or not app.config['MAIL_SENDER_THREAD']:
+        return
+    with mailSenderLock:
+        if mailSenderState['pid'] != os.getpid():
+            mailSenderState['pid'] = os.getpid()
+            mailSenderState['wake'] = threading.Event()
+            threading.Thread(target=mailSenderLoop, name='mailSender', daemon=True).start()
+
+@app.before_request
+def ensureMailSender():
+    # Workers pick up mail queued before a restart without waiting for a new contact
+    startMailSender()
 
 @app.route('/contact/status/<int:contact_id>')
 def contactStatus(contact_id):
@@ -421,9 +798,8 @@ def contactStatus(contact_id):
     try:
         conn = getDataDB()
         cursor = conn.cursor()
-        cursor.execute('SELECT created_at, subject FROM contacts WHERE id = ?', (contact_id,))
+        cursor.execute('SELECT created, subject FROM contacts WHERE id = ?', (contact_id,))
         result = cursor.fetchone()
-        conn.close()
 
         if result:
             return jsonify({
@@ -445,22 +821,1014 @@ def contactStatus(contact_id):
             'message': 'Error checking status'
         }), 500
 
+# ##########################################################
+# Metrics functions
+# ##########################################################
+# Each request collects its SQL and filesystem counts in a thread local, and
+# after the request they are folded into per endpoint totals with the
+# latency histogram, one lock per request. With METRICS_FOLDER set, workers
+# write snapshots there so /metrics can report the whole gunicorn box.
+METRICS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]   # Latency histogram bounds, seconds
+METRICS_FLUSH_INTERVAL = 10                                         # Seconds between worker snapshots
+metricsState = {'endpoints': {}, 'flushed': 0.0}
+metricsLock = threading.Lock()
+metricsLocal = threading.local()
+
+class MeteredCursor(sqlite3.Cursor):
+    # Count and time statements, the time covers preparing and stepping to the first row
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            countSql(time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            countSql(time.perf_counter() - started)
+
+class MeteredConnection(sqlite3.Connection):
+    # Connection whose cursors, including the ones behind execute(), are metered
+    def cursor(self, factory=MeteredCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def countSql(seconds):
+    # Add a statement to the current request's counts
+    current = getattr(metricsLocal, 'current', None)
+    if current is not None:
+        current['sqlQueries'] += 1
+        current['sqlSeconds'] += seconds
+
+def countFs(call):
+    # Add a filesystem call to the current request's counts
+    current = getattr(metricsLocal, 'current', None)
+    if current is not None:
+        current['fs'][call] = current['fs'].get(call, 0) + 1
+
+def startRequestMetrics():
+    metricsLocal.current = {'sqlQueries': 0, 'sqlSeconds': 0.0, 'fs': {}}
+    metricsLocal.started = time.perf_counter()
+
+# First in line, ahead of the limiter's before_request, so 429s are timed and counted too
+app.before_request_funcs.setdefault(None, []).insert(0, startRequestMetrics)
+
+@app.after_request
+def recordRequestMetrics(response):
+    finishRequestMetrics(response.status_code)
+    return response
+
+@app.teardown_request
+def recordFailedRequestMetrics(e=None):
+    # Requests that raised never reach after_request
+    finishRequestMetrics(500)
+
+def finishRequestMetrics(status):
+    # Fold the request's counts into its endpoint totals
+    current = getattr(metricsLocal, 'current', None)
+    if current is None:
+        return
+    metricsLocal.current = None
+    elapsed = time.perf_counter() - metricsLocal.started
+    endpoint = request.endpoint or 'unmatched'
+    bucket = bisect.bisect_left(METRICS_BUCKETS, elapsed)
+
+    with metricsLock:
+        totals = metricsState['endpoints'].get(endpoint)
+        if totals is None:
+            totals = metricsState['endpoints'][endpoint] = {
+                'requests': {}, 'buckets': [0] * (len(METRICS_BUCKETS) + 1), 'seconds': 0.0,
+                'sqlQueries': 0, 'sqlSeconds': 0.0, 'fs': {}
+            }
+        status = str(status)
+        totals['requests'][status] = totals['requests'].get(status, 0) + 1
+        totals['buckets'][bucket] += 1
+        totals['seconds'] += elapsed
+        totals['sqlQueries'] += current['sqlQueries']
+        totals['sqlSeconds'] += current['sqlSeconds']
+        for call, count in current['fs'].items():
+            totals['fs'][call] = totals['fs'].get(call, 0) + count
+
+        now = time.monotonic()
+        flush = app.config['METRICS_FOLDER'] and now - metricsState['flushed'] >= METRICS_FLUSH_INTERVAL
+        if flush:
+            metricsState['flushed'] = now
+            snapshot = json.dumps(metricsState['endpoints'])
+    if flush:
+        writeMetricsSnapshot(snapshot)
+
+def writeMetricsSnapshot(snapshot):
+    # Write this worker's totals where the other workers can read them
+    try:
+        os.makedirs(app.config['METRICS_FOLDER'], exist_ok=True)
+        path = os.path.join(app.config['METRICS_FOLDER'], f"{os.getpid()}.json")
+        with open(path + '.tmp', 'w') as f:
+            f.write(snapshot)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        logger.error(f"[ERROR] Writing metrics snapshot failed: {str(e)}")
+
+def mergeMetrics(target, source):
+    # Add one set of endpoint totals into another
+    for key, value in source.items():
+        if isinstance(value, dict):
+            mergeMetrics(target.setdefault(key, {}), value)
+        elif isinstance(value, list):
+            existing = target.setdefault(key, [0] * len(value))
+            for index, count in enumerate(value):
+                existing[index] += count
+        else:
+            target[key] = target.get(key, 0) + value
+
+def collectMetrics():
+    # Get the endpoint totals of this worker, plus the live workers' snapshots if shared
+    with metricsLock:
+        endpoints = json.loads(json.dumps(metricsState['endpoints']))
+    folder = app.config['METRICS_FOLDER']
+    if not folder or not os.path.isdir(folder):
+        return endpoints
+
+    for name in os.listdir(folder):
+        pid, ext = os.path.splitext(name)
+        if ext != '.json' or not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        path = os.path.join(folder, name)
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            os.remove(path)                                         # The worker is gone, so are its counters
+            continue
+        except PermissionError:
+            pass
+        try:
+            with open(path) as f:
+                mergeMetrics(endpoints, json.load(f))
+        except (OSError, ValueError):
+            continue
+    return endpoints
+
+def renderMetrics(endpoints):
+    # Format endpoint totals in the Prometheus text exposition format
+    lines = [
+        '# HELP italy_requests_total Requests handled, by endpoint and status.',
+        '# TYPE italy_requests_total counter'
+    ]
+    for endpoint, totals in sorted(endpoints.items()):
+        for status, count in sorted(totals['requests'].items()):
+            lines.append(f'italy_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+    lines += [
+        '# HELP italy_request_duration_seconds Request latency, by endpoint.',
+        '# TYPE italy_request_duration_seconds histogram'
+    ]
+    for endpoint, totals in sorted(endpoints.items()):
+        cumulative = 0
+        for bound, count in zip(METRICS_BUCKETS + ['+Inf'], totals['buckets']):
+            cumulative += count
+            lines.append(f'italy_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+        lines.append(f'italy_request_duration_seconds_sum{{endpoint="{endpoint}"}} {totals["seconds"]:.6f}')
+        lines.append(f'italy_request_duration_seconds_count{{endpoint="{endpoint}"}} {cumulative}')
+
+    lines += [
+        '# HELP italy_sql_queries_total SQL statements executed, by endpoint.',
+        '# TYPE italy_sql_queries_total counter'
+    ]
+    lines += [f'italy_sql_queries_total{{endpoint="{endpoint}"}} {totals["sqlQueries"]}' for endpoint, totals in sorted(endpoints.items())]
+    lines += [
+        '# HELP italy_sql_seconds_total Time spent executing SQL statements, by endpoint.',
+        '# TYPE italy_sql_seconds_total counter'
+    ]
+    lines += [f'italy_sql_seconds_total{{endpoint="{endpoint}"}} {totals["sqlSeconds"]:.6f}' for endpoint, totals in sorted(endpoints.items())]
+    lines += [
+        '# HELP italy_fs_calls_total Filesystem calls, by endpoint and call.',
+        '# TYPE italy_fs_calls_total counter'
+    ]
+    for endpoint, totals in sorted(endpoints.items()):
+        for call, count in sorted(totals['fs'].items()):
+            lines.append(f'italy_fs_calls_total{{endpoint="{endpoint}",call="{call}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+@app.route('/metrics')
+@auth.login_required
+def metrics():
+    return Response(renderMetrics(collectMetrics()), mimetype='text/plain; version=0.0.4')
+
 # ##########################################################
 # Data database functions
 # ##########################################################
+# The schema version is kept in PRAGMA user_version. Each migration runs once,
+# in order, inside an immediate transaction so concurrent workers wait for the
+# first one instead of racing it. Migrations only append, never edit a shipped one.
+# Each worker thread keeps one connection open for its whole life, in WAL mode
+# so a comment or post write never blocks the blog readers.
+SQLITE_BUSY_TIMEOUT = 5000                                          # Milliseconds to wait for a writer lock
+SQLITE_STATEMENT_CACHE = 256                                        # Prepared statements kept per connection
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",                                    # Durable at checkpoints, safe in WAL mode
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}",
+    "PRAGMA cache_size=-16384",                                     # 16MB page cache
+    "PRAGMA mmap_size=268435456",                                   # Read through a 256MB memory map
+    "PRAGMA temp_store=MEMORY"
+]
+dataDBLocal = threading.local()
+dataDBState = {'ready': False}                                     # Migrations checked in this process
+
+def getDataMigrations():
+    # Get the data database migrations in order, migration N brings the schema to version N
+    return [
+        # 1: Tables the site has always used, for fresh databases
+        [
+            """CREATE TABLE IF NOT EXISTS comments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                imageName TEXT NOT NULL,
+                author TEXT NOT NULL,
+                comment TEXT NOT NULL,
+                created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )""",
+            """CREATE TABLE IF NOT EXISTS contacts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                firstName TEXT NOT NULL,
+                lastName TEXT NOT NULL,
+                eMail TEXT NOT NULL,
+                phone TEXT,
+                subject TEXT NOT NULL,
+                company TEXT,
+                image TEXT,
+                message TEXT NOT NULL,
+                newsLetter BOOLEAN DEFAULT FALSE,
+                ipAddress TEXT,
+                userAgent TEXT,
+                created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )""",
+            """CREATE TABLE IF NOT EXISTS blogs (
+                id        INTEGER PRIMARY KEY AUTOINCREMENT,
+                title     TEXT    NOT NULL,
+                date      TEXT    NOT NULL,
+                author    TEXT    NOT NULL,
+                category  TEXT    NOT NULL,
+                province  TEXT,
+                city      TEXT,
+                image     TEXT,
+                excerpt   TEXT,
+                content   TEXT,
+                created   TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )"""
+        ],
+        # 2: Blog full-text search
+        BLOG_SEARCH_SCHEMA,
+        # 3: Blog facet counts
+        getBlogFacetSchema(),
+        # 4: Indexes for the comment and blog queries
+        [
+            "CREATE INDEX IF NOT EXISTS commentsImageCreated ON comments(imageName, created)",
+            "CREATE INDEX IF NOT EXISTS blogsDate ON blogs(date)",
+            "CREATE INDEX IF NOT EXISTS blogsTitle ON blogs(title)",
+            "CREATE INDEX IF NOT EXISTS blogsCategoryDate ON blogs(category, date)",
+            "CREATE INDEX IF NOT EXISTS blogsProvinceDate ON blogs(province, date)",
+            "CREATE INDEX IF NOT EXISTS blogsCityDate ON blogs(city, date)",
+            "CREATE INDEX IF NOT EXISTS blogsAuthorDate ON blogs(author, date)",
+            "ANALYZE"
+        ],
+        # 5: Comment counts per image
+        COMMENT_COUNTS_SCHEMA,
+        # 6: Contact form mail outbox
+        MAIL_OUTBOX_SCHEMA,
+        # 7: Author sort in index order, blogsAuthorDate puts the date before the id
+        [
+            "CREATE INDEX IF NOT EXISTS blogsAuthor ON blogs(author)",
+            "ANALYZE"
+        ]
+    ]
+
+def migrateDataDB(conn):
+    # Bring the data database schema up to date
+    migrations = getDataMigrations()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(migrations):
+        return version
+
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, statements in enumerate(migrations[version:], version + 1):
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {number}")
+            logger.info(f"[INFO] Data database migrated to version {number}")
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error(f"[ERROR] Data database migration failed at version {version}: {str(e)}")
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def explainQueryPlan(conn, query, params=()):
+    # Get the query plan steps SQLite would use for a query
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+def tuneConnection(conn):
+    # Apply the connection settings shared by the SQLite databases
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+
+def encodeCursor(row, column):
+    # Encode the keyset position (column value, id) of a row as an opaque URL-safe token
+    data = json.dumps([row[column], row['id']], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+def decodeCursor(token):
+    # Decode a cursor token to (column value, id), or None when it is not one of ours
+    if not token:
+        return None
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if isinstance(value, str) and isinstance(row_id, int):
+            return value, row_id
+    except (ValueError, TypeError):
+        pass
+    return None
+
 def getDataDB():
-    # Get a data database connection
-    if 'db' not in g:
-        g.db = sqlite3.connect(app.config['DATADB'])
-        g.db.row_factory = sqlite3.Row
-    return g.db
+    # Get this thread's data database connection, kept open for the life of the worker.
+    # Reopened when the database path changes or in a forked child.
+    conn = getattr(dataDBLocal, 'conn', None)
+    owner = (app.config['DATADB'], os.getpid())
+    if conn is None or dataDBLocal.owner != owner:
+        conn = sqlite3.connect(app.config['DATADB'], timeout=SQLITE_BUSY_TIMEOUT / 1000,
+                               cached_statements=SQLITE_STATEMENT_CACHE, factory=MeteredConnection)
+        conn.row_factory = sqlite3.Row
+        tuneConnection(conn)
+        if not dataDBState['ready']:
+            migrateDataDB(conn)
+            dataDBState['ready'] = True
+        dataDBLocal.conn = conn
+        dataDBLocal.owner = owner
+    return conn
 
 @app.teardown_appcontext
 def close_db(e=None):
-    # Close the database
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
+    # Keep the connection, but never leave a failed request's transaction open
+    conn = getattr(dataDBLocal, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+# ##########################################################
+# Blog search functions
+# ##########################################################
+# blogsSearch is an external content FTS5 index over the blogs table, kept
+# in sync by triggers so the admin routes need no search specific code.
+SEARCH_WEIGHTS = '10.0, 4.0, 1.0, 2.0'                              # bm25 weights for title, excerpt, content, author
+SEARCH_MARK_START = '\x02'                                          # Snippet match markers, replaced by <mark> after escaping
+SEARCH_MARK_END = '\x03'
+SEARCH_SNIPPET_TOKENS = 32                                          # Words per result snippet
+
+BLOG_SEARCH_SCHEMA = [                                              # Index, sync triggers and initial fill
+    """CREATE VIRTUAL TABLE IF NOT EXISTS blogsSearch USING fts5(
+        title, excerpt, content, author,
+        content='blogs', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS blogsSearchInsert AFTER INSERT ON blogs BEGIN
+        INSERT INTO blogsSearch(rowid, title, excerpt, content, author)
+        VALUES (new.id, new.title, new.excerpt, new.content, new.author);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS blogsSearchDelete AFTER DELETE ON blogs BEGIN
+        INSERT INTO blogsSearch(blogsSearch, rowid, title, excerpt, content, author)
+        VALUES ('delete', old.id, old.title, old.excerpt, old.content, old.author);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS blogsSearchUpdate AFTER UPDATE ON blogs BEGIN
+        INSERT INTO blogsSearch(blogsSearch, rowid, title, excerpt, content, author)
+        VALUES ('delete', old.id, old.title, old.excerpt, old.content, old.author);
+        INSERT INTO blogsSearch(rowid, title, excerpt, content, author)
+        VALUES (new.id, new.title, new.excerpt, new.content, new.author);
+    END""",
+    "INSERT INTO blogsSearch(blogsSearch) VALUES ('rebuild')"
+]
+
+def buildSearchMatch(searchQuery):
+    # Turn what the visitor typed into an FTS5 query: every word must match, the last one as a prefix
+    words = re.findall(r'\w+', searchQuery.lower())
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def formatSearchSnippet(snippet):
+    # Escape a search snippet for the cards and highlight the matches
+    if not snippet:
+        return ''
+    text = re.sub(r'<[^>]*>?', '', snippet)                          # Strip HTML from post content
+    text = escape(text)
+    return text.replace(SEARCH_MARK_START, '<mark>').replace(SEARCH_MARK_END, '</mark>')
+
+# ##########################################################
+# Blog facet functions
+# ##########################################################
+# Filter sidebar counts live in blogFacets, maintained by triggers on blogs.
+# The triggers also bump the blogs row of dataVersions on every write, so
+# each worker can cache drill-down counts and totals until the posts change.
+BLOG_FACETS = [                                                     # Column and sidebar name of each filter
+    ('category', 'categories'),
+    ('province', 'provinces'),
+    ('city', 'cities'),
+    ('author', 'authors')
+]
+BLOG_CACHE_SIZE = 256                                               # Filter combinations cached per worker
+blogCache = {'version': None, 'facets': {}, 'totals': {}}
+blogCacheLock = threading.Lock()
+
+def getBlogFacetSchema():
+    # Get the statements creating the facet counts, their triggers and initial fill
+    increments = ''.join(f"""
+        INSERT INTO blogFacets(facet, value, count) SELECT '{column}', new.{column}, 1 WHERE new.{column} IS NOT NULL
+        ON CONFLICT(facet, value) DO UPDATE SET count = count + 1;""" for column, _ in BLOG_FACETS)
+    decrements = ''.join(f"""
+        UPDATE blogFacets SET count = count - 1 WHERE facet = '{column}' AND value = old.{column};""" for column, _ in BLOG_FACETS)
+    return [
+        """CREATE TABLE IF NOT EXISTS blogFacets (
+            facet TEXT NOT NULL,
+            value TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (facet, value)
+        ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS dataVersions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )""",
+        "INSERT OR IGNORE INTO dataVersions(name, version) VALUES ('blogs', 0)",
+        f"""CREATE TRIGGER IF NOT EXISTS blogFacetsInsert AFTER INSERT ON blogs BEGIN{increments}
+        UPDATE dataVersions SET version = version + 1 WHERE name = 'blogs';
+    END""",
+        f"""CREATE TRIGGER IF NOT EXISTS blogFacetsDelete AFTER DELETE ON blogs BEGIN{decrements}
+        DELETE FROM blogFacets WHERE count <= 0;
+        UPDATE dataVersions SET version = version + 1 WHERE name = 'blogs';
+    END""",
+        f"""CREATE TRIGGER IF NOT EXISTS blogFacetsUpdate AFTER UPDATE ON blogs BEGIN{decrements}{increments}
+        DELETE FROM blogFacets WHERE count <= 0;
+        UPDATE dataVersions SET version = version + 1 WHERE name = 'blogs';
+    END""",
+        "DELETE FROM blogFacets"
+    ] + [f"""INSERT INTO blogFacets(facet, value, count)
+        SELECT '{column}', {column}, COUNT(*) FROM blogs WHERE {column} IS NOT NULL GROUP BY {column}""" for column, _ in BLOG_FACETS]
+
+def getBlogVersion(cursor):
+    # Get the version of the blogs table, bumped by the triggers on every write, once per request
+    if 'blogVersion' not in g:
+        row = cursor.execute("SELECT version FROM dataVersions WHERE name = 'blogs'").fetchone()
+        g.blogVersion = row[0] if row else 0
+    return g.blogVersion
+
+def readBlogCache(kind, key, version):
+    # Get a cached facet or total result, dropping the cache when the posts changed
+    with blogCacheLock:
+        if blogCache['version'] != version:
+            blogCache.update({'version': version, 'facets': {}, 'totals': {}})
+        return blogCache[kind].get(key)
+
+def writeBlogCache(kind, key, version, value):
+    # Cache a facet or total result computed at the given version
+    with blogCacheLock:
+        if blogCache['version'] == version:
+            if len(blogCache[kind]) >= BLOG_CACHE_SIZE:
+                blogCache[kind] = {}
+            blogCache[kind][key] = value
+
+def getBlogFacets(cursor, filters, searchMatch=None):
+    # Get the sidebar counts for each facet, drilled down by the active filters and search.
+    # A facet's own filter is left out of its counts, so its other values stay selectable.
+    active = [(column, filters[column]) for column, _ in BLOG_FACETS if filters.get(column)]
+    key = (tuple(active), searchMatch)
+    version = getBlogVersion(cursor)
+    facets = readBlogCache('facets', key, version)
+    if facets is not None:
+        return facets
+
+    counts = {column: {} for column, _ in BLOG_FACETS}
+    if not active and not searchMatch:
+        # No drill-down, read the maintained counts
+        for row in cursor.execute("SELECT facet, value, count FROM blogFacets"):
+            if row['facet'] in counts:
+                counts[row['facet']][row['value']] = row['count']
+    else:
+        # One pass over the posts matching all, or all but one, of the active filters
+        query = "SELECT blogs.category, blogs.province, blogs.city, blogs.author FROM blogs"
+        params = []
+        if searchMatch:
+            query += " JOIN blogsSearch ON blogsSearch.rowid = blogs.id WHERE blogsSearch MATCH ?"
+            params.append(searchMatch)
+        else:
+            query += " WHERE 1=1"
+        if len(active) > 1:
+            query += " AND " + " + ".join(f"(blogs.{column} IS ?)" for column, _ in active) + f" >= {len(active) - 1}"
+            params.extend(value for _, value in active)
+        for row in cursor.execute(query, params):
+            misses = [column for column, value in active if row[column] != value]
+            if len(misses) > 1:
+                continue
+            for column, _ in BLOG_FACETS:
+                value = row[column]
+                if value is not None and (not misses or misses[0] == column):
+                    counts[column][value] = counts[column].get(value, 0) + 1
+
+    facets = {name: [{'name': value, 'count': counts[column][value]} for value in sorted(counts[column])]
+              for column, name in BLOG_FACETS}
+    writeBlogCache('facets', key, version, facets)
+    return facets
+
+# ##########################################################
+# Blog pagination functions
+# ##########################################################
+# Next and previous pages are fetched by keyset on (sort column, id), so
+# deep pages cost the same as the first. Numbered page jumps still use
+# OFFSET, and relevance order has no stable key so it always does.
+BLOG_SORTS = {                                                      # Sort option -> column and direction
+    'title_asc': ('title', 'ASC'),
+    'title_desc': ('title', 'DESC'),
+    'date_asc': ('date', 'ASC'),
+    'date_desc': ('date', 'DESC'),
+    'author_asc': ('author', 'ASC'),
+    'author_desc': ('author', 'DESC')
+}
+
+BLOG_POST_QUERY = "SELECT * FROM blogs WHERE id = ?"               # One post, also explained by check-queries
+
+def buildBlogQuery(filters, searchQuery, searchMatch, sortBy, after=None, before=None, page=1, perPage=postsPerPage):
+    # Build the SQL of one blog page and of its total count, as the blog route
+    # runs it and check-queries explains it. column is the keyset sort column,
+    # None when ranked by relevance.
+    select = "SELECT blogs.*"
+    fromClause = " FROM blogs"
+    where = " WHERE 1=1"
+    params = []
+    selectParams = []
+
+    if searchQuery:
+        if searchMatch:
+            select += f", snippet(blogsSearch, -1, ?, ?, '…', {SEARCH_SNIPPET_TOKENS}) AS snippet"
+            selectParams.extend([SEARCH_MARK_START, SEARCH_MARK_END])
+            fromClause += " JOIN blogsSearch ON blogsSearch.rowid = blogs.id"
+            where += " AND blogsSearch MATCH ?"
+            params.append(searchMatch)
+        else:
+            where += " AND 0"                                       # Nothing searchable was typed
+
+    for column, _ in BLOG_FACETS:
+        if filters.get(column):
+            where += f" AND blogs.{column} = ?"
+            params.append(filters[column])
+
+    # Apply sorting, with the id as tie breaker so every position has a unique key
+    column, direction = BLOG_SORTS.get(sortBy, BLOG_SORTS['date_desc'])
+    keyset = after or before
+    if sortBy == 'relevance' and searchMatch:
+        column = None
+        order = f" ORDER BY bm25(blogsSearch, {SEARCH_WEIGHTS}), blogs.date DESC, blogs.id DESC"
+        keyset = None
+    elif before and not after:
+        # Walk backwards from the first post of the next page, the route restores the order
+        reverse = 'ASC' if direction == 'DESC' else 'DESC'
+        order = f" ORDER BY blogs.{column} {reverse}, blogs.id {reverse}"
+    else:
+        order = f" ORDER BY blogs.{column} {direction}, blogs.id {direction}"
+
+    if keyset:
+        comparison = '<' if (direction == 'DESC') == bool(after) else '>'
+        query = select + fromClause + where + f" AND (blogs.{column}, blogs.id) {comparison} (?, ?)" + order + " LIMIT ?"
+        queryParams = selectParams + params + list(keyset) + [perPage]
+    else:
+        query = select + fromClause + where + order + " LIMIT ? OFFSET ?"
+        queryParams = selectParams + params + [perPage, (page - 1) * perPage]
+
+    return {
+        'query': query,
+        'params': queryParams,
+        'count': "SELECT COUNT(*)" + fromClause + where,
+        'countParams': params,
+        'column': column
+    }
+
+def getBlogTotal(cursor, query, params):
+    # Count the posts matching the filters, cached per filter combination until the posts change
+    key = (query, tuple(params))
+    version = getBlogVersion(cursor)
+    total = readBlogCache('totals', key, version)
+    if total is None:
+        total = cursor.execute(query, params).fetchone()[0]
+        writeBlogCache('totals', key, version, total)
+    return total
+
+# ##########################################################
+# Content index functions
+# ##########################################################
+# The content tree only changes when we upload photos, so each worker keeps
+# an in-memory index of it and the gallery routes never list directories.
+# Folders are keyed by their path relative to CONTENT_FOLDER ('' is the root).
+contentIndex = {
+    'folders': {},                                                  # Relative path -> folder node
+    'version': 0,                                                   # Bumped whenever anything changes
+    'treeVersion': 0,                                               # Bumped when folders or keywords change
+    'fingerprint': '',                                              # Hash of all mtimes, the same in every worker
+    'checked': 0.0                                                  # Monotonic time of the last mtime check
+}
+contentIndexLock = threading.Lock()
+
+# Breadcrumbs and inherited keywords of every folder, derived from the index
+folderTree = {
+    'version': -1,                                                  # contentIndex treeVersion the nodes were built from
+    'nodes': {}                                                     # Relative path -> {'keywords', 'breadcrumbs'}, read-only
+}
+folderTreeLock = threading.Lock()
+
+def contentKey(path):
+    # Normalize a relative or absolute folder path to its index key
+    # Returns None for paths that point outside the content folder
+    if os.path.isabs(path):
+        path = os.path.relpath(path, app.config['CONTENT_FOLDER'])
+    path = os.path.normpath(path) if path else '.'
+    if path == '.':
+        return ''
+    if path == '..' or path.startswith('..' + os.sep) or os.path.isabs(path):
+        return None
+    return path.replace(os.sep, '/')
+
+def getGuideFilename(folderKey, ext='.txt'):
+    # Guides are named after their folder, the root guide is just Guide.txt
+    if folderKey:
+        return f"{folderKey.rsplit('/', 1)[-1]} Guide{ext}"
+    return f"Guide{ext}"
+
+def scanContentFolder(folderKey, folderMtime):
+    # List one folder and build its index node
+    folderFullPath = os.path.join(app.config['CONTENT_FOLDER'], folderKey) if folderKey else app.config['CONTENT_FOLDER']
+    guideFilenames = [getGuideFilename(folderKey, ext) for ext in GUIDE_EXTENSIONS]
+
+    node = {
+        'path': folderKey,
+        'fullPath': folderFullPath,
+        'mtime': folderMtime,
+        'folders': [],                                              # Subfolder names
+        'images': [],                                               # Image names
+        'sidecars': {},                                             # Image name -> sidecar full paths
+        'guide': None,                                              # Guide full path, if present
+        'keywords': [],                                             # Parsed keywords.txt
+        'watch': {}                                                 # Image, sidecar and text file full path -> mtime
+    }
+
+    xmpFiles = {}
+    countFs('scandir')
+    with os.scandir(folderFullPath) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                node['folders'].append(entry.name)
+                continue
+            if not entry.is_file():
+                continue
+            base, ext = os.path.splitext(entry.name)
+            if isImage(entry.name):
+                node['images'].append(entry.name)
+                node['watch'][entry.path] = entry.stat().st_mtime_ns
+            elif ext in ('.xmp', '.XMP'):
+                xmpFiles.setdefault(base, []).append(entry.path)
+                node['watch'][entry.path] = entry.stat().st_mtime_ns
+            elif entry.name in guideFilenames:
+                if node['guide'] is None or guideFilenames.index(entry.name) < guideFilenames.index(os.path.basename(node['guide'])):
+                    node['guide'] = entry.path
+                node['watch'][entry.path] = entry.stat().st_mtime_ns
+            elif entry.name in ('about.txt', 'keywords.txt'):
+                node['watch'][entry.path] = entry.stat().st_mtime_ns
+
+    # Keep the lookup order getImageMetadata always used: .xmp before .XMP
+    for name in node['images']:
+        sidecars = xmpFiles.get(os.path.splitext(name)[0])
+        if sidecars:
+            node['sidecars'][name] = sorted(sidecars, key=lambda p: not p.endswith('.xmp'))
+
+    keywordsContent = read_text_file(os.path.join(folderFullPath, 'keywords.txt'))
+    if keywordsContent:
+        node['keywords'] = [k.strip() for k in keywordsContent.split(',') if k.strip()]
+
+    node['folders'].sort(key=lambda x: x.lower())
+    node['images'].sort(key=lambda x: x.lower())
+    return node
+
+def refreshContentIndex(force=False):
+    # Bring the index up to date, re-listing only folders whose mtime changed
+    # Checks are throttled to one every CONTENT_INDEX_TTL seconds per worker.
+    # The folders dict is never changed in place: a refresh builds a new one and
+    # swaps it in, so readers can iterate theirs without holding the lock.
+    now = time.monotonic()
+    if not force and contentIndex['folders'] and now - contentIndex['checked'] < app.config['CONTENT_INDEX_TTL']:
+        return
+
+    with contentIndexLock:
+        if not force and contentIndex['folders'] and now - contentIndex['checked'] < app.config['CONTENT_INDEX_TTL']:
+            return
+
+        previousFolders = contentIndex['folders']
+        folders = {}
+        changed = False
+        treeChanged = False
+        pending = ['']
+        while pending:
+            folderKey = pending.pop()
+            folderFullPath = os.path.join(app.config['CONTENT_FOLDER'], folderKey) if folderKey else app.config['CONTENT_FOLDER']
+            try:
+                countFs('stat')
+                folderMtime = os.stat(folderFullPath).st_mtime_ns
+            except OSError:
+                continue
+
+            node = previousFolders.get(folderKey)
+            stale = node is None or node['mtime'] != folderMtime
+            if not stale:
+                # Files can be replaced in place without touching the folder mtime
+                for watchPath, watchMtime in node['watch'].items():
+                    try:
+                        countFs('stat')
+                        stale = os.stat(watchPath).st_mtime_ns != watchMtime
+                    except OSError:
+                        stale = True
+                    if stale:
+                        break
+            if stale:
+                previous = node
+                try:
+                    node = scanContentFolder(folderKey, folderMtime)
+                except OSError as e:
+                    logger.error(f"[ERROR] Content index scan failed: {folderKey}: {str(e)}")
+                    continue
+                changed = True
+                if previous is None or previous['keywords'] != node['keywords']:
+                    treeChanged = True
+
+            folders[folderKey] = node
+            for name in node['folders']:
+                pending.append(f"{folderKey}/{name}" if folderKey else name)
+
+        if previousFolders.keys() - folders.keys():
+            changed = True
+            treeChanged = True
+
+        if changed:
+            contentIndex['folders'] = folders
+        if treeChanged:
+            contentIndex['treeVersion'] += 1
+
+        if changed:
+            fingerprint = hashlib.sha1()
+            for folderKey in sorted(folders):
+                node = folders[folderKey]
+                fingerprint.update(f"{folderKey}\0{node['mtime']}\0".encode('utf-8', 'surrogateescape'))
+                for watchPath in sorted(node['watch']):
+                    fingerprint.update(f"{watchPath}\0{node['watch'][watchPath]}\0".encode('utf-8', 'surrogateescape'))
+            contentIndex['fingerprint'] = fingerprint.hexdigest()[:16]
+            contentIndex['version'] += 1
+            logger.info(f"[INFO] Content index refreshed: {len(folders)} folders, version {contentIndex['version']}")
+        contentIndex['checked'] = now
+
+def buildFolderTree():
+    # Give every folder its breadcrumb chain and its keywords merged with all
+    # of its ancestors', its own first, each keyword once
+    folders = contentIndex['folders']
+    nodes = {}
+    for folderKey in sorted(folders):                               # Parents sort before their children
+        keywords = folders[folderKey]['keywords']
+        if not folderKey:
+            nodes[folderKey] = {
+                'keywords': list(dict.fromkeys(keywords)),
+                'breadcrumbs': [{'name': 'Home', 'path': ''}]
+            }
+            continue
+        parentKey, _, name = folderKey.rpartition('/')
+        parent = nodes.get(parentKey, {'keywords': [], 'breadcrumbs': [{'name': 'Home', 'path': ''}]})
+        nodes[folderKey] = {
+            'keywords': list(dict.fromkeys(keywords + parent['keywords'])),
+            'breadcrumbs': parent['breadcrumbs'] + [{'name': name, 'path': folderKey}]
+        }
+    return nodes
+
+def getFolderTree():
+    # Get the folder tree, rebuilt only when a folder or a keywords.txt changed
+    refreshContentIndex()
+    if folderTree['version'] != contentIndex['treeVersion']:
+        with folderTreeLock:
+            if folderTree['version'] != contentIndex['treeVersion']:
+                version = contentIndex['treeVersion']
+                folderTree['nodes'] = buildFolderTree()
+                folderTree['version'] = version
+    return folderTree['nodes']
+
+def getContentFolder(path):
+    # Get the index node for a folder, or None if there is no such folder
+    refreshContentIndex()
+    folderKey = contentKey(path)
+    if folderKey is None:
+        return None
+    return contentIndex['folders'].get(folderKey)
+
+# ##########################################################
+# Image metadata cache functions
+# ##########################################################
+# Parsed XMP metadata is kept in METADATADB, keyed by image path and
+# validated by the mtime and size of the file it was read from, so a warm
+# render does no XML parsing. Each worker also keeps the rows in memory.
+imageMetadataCache = {
+    'loaded': False,                                                # Rows have been read from METADATADB
+    'images': {}                                                    # Relative image path -> cached record
+}
+imageMetadataLock = threading.Lock()
+metadataDBLocal = threading.local()
+
+def getMetadataDB():
+    # Get this thread's metadata database connection, kept open for the life of the worker.
+    # Reopened when the database path changes or in a forked child.
+    conn = getattr(metadataDBLocal, 'conn', None)
+    owner = (app.config['METADATADB'], os.getpid())
+    if conn is None or metadataDBLocal.owner != owner:
+        conn = sqlite3.connect(app.config['METADATADB'], timeout=SQLITE_BUSY_TIMEOUT / 1000,
+                               cached_statements=SQLITE_STATEMENT_CACHE, factory=MeteredConnection)
+        conn.row_factory = sqlite3.Row
+        tuneConnection(conn)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS imageMetadata (
+                path TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                mtime INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                title TEXT,
+                fullTitle TEXT,
+                description TEXT,
+                dateCreated TEXT,
+                latitude REAL,
+                longitude REAL,
+                subjects TEXT
+            )
+        """)
+        conn.commit()
+        metadataDBLocal.conn = conn
+        metadataDBLocal.owner = owner
+    return conn
+
+def metadataRecord(row):
+    # Convert an imageMetadata row to a cache record
+    return {
+        'source': row['source'],
+        'mtime': row['mtime'],
+        'size': row['size'],
+        'metadata': {
+            'title': row['title'] or '',
+            'fullTitle': row['fullTitle'] or '',
+            'description': row['description'] or '',
+            'dateCreated': row['dateCreated'] or '',
+            'latitude': row['latitude'],
+            'longitude': row['longitude'],
+            'subjects': json.loads(row['subjects']) if row['subjects'] else []
+        }
+    }
+
+def lookupImageMetadata(key):
+    # Get the cached record for an image, loading the whole store on first use
+    if not imageMetadataCache['loaded']:
+        with imageMetadataLock:
+            if not imageMetadataCache['loaded']:
+                try:
+                    rows = getMetadataDB().execute("SELECT * FROM imageMetadata").fetchall()
+                    imageMetadataCache['images'].update({row['path']: metadataRecord(row) for row in rows})
+                except sqlite3.Error as e:
+                    logger.error(f"[ERROR] Loading image metadata cache failed: {str(e)}")
+                imageMetadataCache['loaded'] = True
+    return imageMetadataCache['images'].get(key)
+
+def storeImageMetadata(key, source, mtime, size, metadata):
+    # Remember freshly parsed metadata in memory and on disk
+    imageMetadataCache['images'][key] = {'source': source, 'mtime': mtime, 'size': size, 'metadata': metadata}
+    try:
+        conn = getMetadataDB()
+        conn.execute("""
+            INSERT OR REPLACE INTO imageMetadata
+            (path, source, mtime, size, title, fullTitle, description, dateCreated, latitude, longitude, subjects)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            key, source, mtime, size,
+            metadata['title'], metadata['fullTitle'], metadata['description'], metadata['dateCreated'],
+            metadata['latitude'], metadata['longitude'], json.dumps(metadata['subjects'])
+        ))
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"[ERROR] Saving image metadata failed: {key}: {str(e)}")
+
+# ##########################################################
+# Blog images index functions
+# ##########################################################
+# Blog posts link their images with whatever case the author typed, so
+# IMAGES_FOLDER is indexed by lowercased path and by lowercased file name.
+# The index is rebuilt when the mtime of any folder in it changes.
+dataImagesIndex = {
+    'paths': set(),                                                 # Relative paths, exact case
+    'names': {},                                                    # Lowercased relative path or file name -> relative path
+    'folders': {},                                                  # Folder full path -> mtime
+    'checked': 0.0                                                  # Monotonic time of the last mtime check
+}
+dataImagesLock = threading.Lock()
+
+def refreshDataImagesIndex():
+    # Rebuild the images index if any of its folders changed since the last check
+    now = time.monotonic()
+    if dataImagesIndex['folders'] and now - dataImagesIndex['checked'] < app.config['CONTENT_INDEX_TTL']:
+        return
+
+    with dataImagesLock:
+        if dataImagesIndex['folders'] and now - dataImagesIndex['checked'] < app.config['CONTENT_INDEX_TTL']:
+            return
+
+        stale = not dataImagesIndex['folders']
+        for folderPath, folderMtime in dataImagesIndex['folders'].items():
+            try:
+                stale = os.stat(folderPath).st_mtime_ns != folderMtime
+            except OSError:
+                stale = True
+            if stale:
+                break
+
+        if stale:
+            base_dir = app.config['IMAGES_FOLDER']
+            paths = set()
+            names = {}
+            folders = {}
+            for root, dirs, files in os.walk(base_dir):
+                dirs.sort()
+                try:
+                    folders[root] = os.stat(root).st_mtime_ns
+                except OSError:
+                    continue
+                for f in sorted(files):
+                    rel_path = os.path.relpath(os.path.join(root, f), base_dir)
+                    paths.add(rel_path)
+                    names.setdefault(rel_path.lower(), rel_path)
+                    names.setdefault(f.lower(), rel_path)
+            dataImagesIndex.update({'paths': paths, 'names': names, 'folders': folders})
+            logger.info(f"[INFO] Images index refreshed: {len(paths)} files")
+        dataImagesIndex['checked'] = now
+
+def findDataImage(filename):
+    # Get the relative path of a blog image, matching case-insensitively, or None
+    refreshDataImagesIndex()
+    if filename in dataImagesIndex['paths']:
+        return filename
+    return dataImagesIndex['names'].get(filename.lower())
+
+# ##########################################################
+# Guide functions
+# ##########################################################
+# Each folder may have a guide named after it: "<Folder> Guide.txt" holds
+# HTML, "<Folder> Guide.md" Markdown. A guide is rendered once per worker and
+# kept with its meta description, keyed by the mtime the content index saw, so
+# a page view reads no file. Folders without a guide are logged once, not on
+# every view.
+GUIDE_EXTENSIONS = ['.txt', '.md']                                  # When a folder has both, the first wins
+GUIDE_DESCRIPTION_LENGTH = 155                                      # Characters of meta description
+guideCache = {
+    'guides': {},                                                   # Guide full path -> {'mtime', 'html', 'description'}
+    'missing': {}                                                   # Folder key -> folder mtime its missing guide was logged at
+}
+
+def renderGuide(guidePath):
+    # Render a guide to HTML and a plain text meta description
+    text = read_text_file(guidePath)
+    if text and guidePath.endswith('.md'):
+        text = markdown.markdown(text, extensions=['extra'])
+    description = ''
+    if text:
+        plain_text = unescape(re.sub('<[^<]+?>', '', text)).strip()
+        description = plain_text[:GUIDE_DESCRIPTION_LENGTH] + "..." if len(plain_text) > GUIDE_DESCRIPTION_LENGTH else plain_text
+    return {'html': text, 'description': description}
+
+def getFolderGuide(folderKey, node):
+    # Get the rendered guide of a folder, or None if it has none
+    if not node or not node['guide']:
+        mtime = node['mtime'] if node else None
+        if guideCache['missing'].get(folderKey, 0) != mtime:
+            guideCache['missing'][folderKey] = mtime
+            logger.error(f"[ERROR] Guide file missing: {getGuideFilename(folderKey)}")
+        return None
+
+    guidePath = node['guide']
+    mtime = node['watch'].get(guidePath)
+    guide = guideCache['guides'].get(guidePath)
+    if guide is None or guide['mtime'] != mtime:
+        guide = dict(renderGuide(guidePath), mtime=mtime)
+        guideCache['guides'][guidePath] = guide
+    return guide
 
 # ##########################################################
 # Helper functions for metadata collection
@@ -476,53 +1844,31 @@ def read_text_file(file_path):
     return None
 
 def build_hierarchical_metadata(current_path):
-    """Build hierarchical metadata by traversing up the directory tree"""
-    keywords = []
-    breadcrumbs = []
-
-    # Convert to absolute path if it's relative
+    """Get the breadcrumbs and inherited keywords of a folder from the folder tree"""
+    # The lists are shared by every request, copy them before changing them
+    nodes = getFolderTree()
+    folder_key = contentKey(current_path)
+    node = nodes.get(folder_key) if folder_key is not None else None
+    if node:
+        return node
+
+    # Not a folder we know, e.g. from an old Referer: breadcrumbs from the path
+    # and the keywords of the nearest folder above it
     if not os.path.isabs(current_path):
         current_path = os.path.join(app.config['CONTENT_FOLDER'], current_path)
-
-    # Build breadcrumbs and collect keywords
-    path_parts = []
     relative_path = os.path.relpath(current_path, app.config['CONTENT_FOLDER'])
-
-    if relative_path != '.':
-        path_parts = relative_path.split(os.sep)
-
-    # Add home breadcrumb
-    breadcrumbs.append({'name': 'Home', 'path': ''})
-
-    # Add intermediate breadcrumbs
+    breadcrumbs = [{'name': 'Home', 'path': ''}]
     current_rel_path = ''
-    for part in path_parts:
-        if current_rel_path:
-            current_rel_path = os.path.join(current_rel_path, part)
-        else:
-            current_rel_path = part
+    for part in (relative_path.split(os.sep) if relative_path != '.' else []):
+        current_rel_path = os.path.join(current_rel_path, part) if current_rel_path else part
         breadcrumbs.append({'name': part, 'path': current_rel_path})
 
-    # Collect keywords from current directory up to root
-    current_check_path = current_path
-    content_folder = os.path.abspath(app.config['CONTENT_FOLDER'])
-
-    while current_check_path and os.path.commonpath([current_check_path, content_folder]) == content_folder:
-        keywords_file = os.path.join(current_check_path, 'keywords.txt')
-        keywords_content = read_text_file(keywords_file)
-
-        if keywords_content:
-            # Split keywords and add to list (avoiding duplicates)
-            folder_keywords = [k.strip() for k in keywords_content.split(',') if k.strip()]
-            for keyword in folder_keywords:
-                if keyword not in keywords:
-                    keywords.append(keyword)
-
-        # Move up one directory
-        parent_path = os.path.dirname(current_check_path)
-        if parent_path == current_check_path:  # Reached root
+    keywords = []
+    while folder_key:
+        folder_key = folder_key.rpartition('/')[0]
+        if folder_key in nodes:
+            keywords = nodes[folder_key]['keywords']
             break
-        current_check_path = parent_path
 
     return {
         'keywords': keywords,
@@ -535,30 +1881,16 @@ def build_page_metadata(folder_path, contents):
     metadata = build_hierarchical_metadata(folder_path)
 
     # Get current folder info
-    folder_full_path = os.path.join(app.config['CONTENT_FOLDER'], folder_path) if folder_path else app.config['CONTENT_FOLDER']
+    folder_node = getContentFolder(folder_path)
     folder_name = os.path.basename(folder_path) if folder_path else appTitle
 
-    # Read guide file based on current folder name and return HTML content and meta description.
+    # The guide comes rendered, with its meta description, from the guide cache
     about_text = "Guide missing! Check back later."
-    if folder_path:
-       # Extract the last folder name from the path
-        last_folder = os.path.basename(folder_path.rstrip('/'))
-        guide_filename = f"{last_folder} Guide.txt"
-    else:
-        guide_filename = f"Guide.txt"
-    guide_file_path = os.path.join(folder_full_path, guide_filename)
-
-    if os.path.exists(guide_file_path):
-        about_text = read_text_file(guide_file_path)
-    else:
-        logger.error(f"[ERROR] Guide file missing: {guide_filename}")
-
-    # Create meta description from HTML content
-    meta_description = "Browse our Guides"
-    if about_text:
-        plain_text = re.sub('<[^<]+?>', '', about_text)
-        plain_text = unescape(plain_text).strip()
-        meta_description = plain_text[:155] + "..." if len(plain_text) > 155 else plain_text
+    meta_description = about_text
+    guide = getFolderGuide(contentKey(folder_path) or '', folder_node)
+    if guide:
+        about_text = guide['html']
+        meta_description = guide['description'] if about_text else "Browse our Guides"
 
     folder_name = os.path.basename(folder_path) if folder_path else appTitle
 
@@ -601,145 +1933,287 @@ def build_page_metadata(folder_path, contents):
 # ##########################################################
 # Image processing functions
 # ##########################################################
-def getImageMetadata(imageFullPathWithName):
-    # Get image metadata from sidecar XMP file first, then from embedded XMP
-    # Image path is full disk path to image
+# XMP namespaces we read metadata from
+xmpNamespaces = {
+    'dc': 'http://purl.org/dc/elements/1.1/',
+    'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+    'exif': 'http://ns.adobe.com/exif/1.0/',
+    'photoshop': 'http://ns.adobe.com/photoshop/1.0/',
+    'xmp': 'http://ns.adobe.com/xap/1.0/'
+}
+
+def emptyImageMetadata():
+    # Metadata for an image we know nothing about
+    return {
+        'title': '',
+        'fullTitle': '',
+        'description': '',
+        'dateCreated': '',
+        'latitude': None,
+        'longitude': None,
+        'subjects': []
+    }
+
+def parseXmpCoordinate(value, ref=''):
+    # XMP GPS values are either decimal degrees or "DDD,MM.mmmK"
+    try:
+        value = value.strip()
+        hemisphere = ref.strip().upper()
+        if value and value[-1].upper() in 'NSEW':
+            hemisphere = value[-1].upper()
+            value = value[:-1]
+        parts = [float(part) for part in value.split(',')]
+        degrees = parts[0] + sum(part / 60 ** i for i, part in enumerate(parts[1:], 1))
+        return -degrees if hemisphere in ('S', 'W') else degrees
+    except (ValueError, IndexError, AttributeError):
+        return None
+
+def parseXmpMetadata(xmp_str, sidecar=True):
+    # Parse an XMP packet into our image metadata
+    # Sidecars may hold dc values as plain text, embedded XMP always uses rdf:Alt
+    root = ET.fromstring(xmp_str)
+    ns = xmpNamespaces
+
+    def get_text(tag):
+        if sidecar:
+            # First try direct text element
+            el = root.find(f'.//dc:{tag}', ns)
+            if el is not None and el.text:
+                return el.text.strip()
+
+        # Fall back to rdf:Alt/rdf:li structure
+        el = root.find(f'.//dc:{tag}/rdf:Alt/rdf:li', ns)
+        return el.text.strip() if el is not None and el.text else ""
+
+    def get_value(prefix, tag):
+        # Values are either child elements or attributes of rdf:Description
+        el = root.find(f'.//{prefix}:{tag}', ns)
+        if el is not None and el.text:
+            return el.text.strip()
+        for desc in root.iter(f"{{{ns['rdf']}}}Description"):
+            value = desc.get(f"{{{ns[prefix]}}}{tag}")
+            if value:
+                return value.strip()
+        return ""
+
+    title = get_text('description')
+    description = get_text('title')
+
+    if title is None and description is None:
+        title = ''
+        fullTitle = ''
+    else:
+        if title is None:
+            title = description
+        else:
+            fullTitle = title + ', on ' + description
+
+    metadata = emptyImageMetadata()
+    metadata.update({
+        'title': title,
+        'fullTitle': fullTitle,
+        'description': description,
+        'dateCreated': get_value('photoshop', 'DateCreated') or get_value('xmp', 'CreateDate') or get_value('exif', 'DateTimeOriginal'),
+        'latitude': parseXmpCoordinate(get_value('exif', 'GPSLatitude'), get_value('exif', 'GPSLatitudeRef')),
+        'longitude': parseXmpCoordinate(get_value('exif', 'GPSLongitude'), get_value('exif', 'GPSLongitudeRef')),
+        'subjects': [el.text.strip() for el in root.findall('.//dc:subject//rdf:li', ns) if el.text and el.text.strip()]
+    })
+    return metadata
+
+# Embedded XMP lives in a JPEG APP1 segment that starts with this namespace
+XMP_APP1_HEADER = b'http://ns.adobe.com/xap/1.0/\x00'
+XMP_START = b'<x:xmpmeta'
+XMP_END = b'</x:xmpmeta>'
+EMBEDDED_XMP_WINDOW = 256 * 1024                                    # Bytes searched at each end of non-JPEG files
+
+def scanJpegXmp(f):
+    # Walk the JPEG segment headers of an open file and return the XMP APP1 payload
+    # Only segment headers and the XMP segment itself are read, everything else is skipped
+    if f.read(2) != b'\xff\xd8':
+        return None
+
+    while True:
+        if f.read(1) != b'\xff':
+            return None
+        marker = f.read(1)
+        while marker == b'\xff':                                    # Fill bytes
+            marker = f.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+
+        if marker in (0xDA, 0xD9):                                  # Start of scan or end of image, no XMP in the headers
+            return None
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:                # Standalone markers have no length
+            continue
 
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        length = int.from_bytes(length, 'big') - 2
+        if length < 0:
+            return None
+
+        if marker == 0xE1 and length >= len(XMP_APP1_HEADER):
+            if f.read(len(XMP_APP1_HEADER)) == XMP_APP1_HEADER:
+                return f.read(length - len(XMP_APP1_HEADER))
+            f.seek(length - len(XMP_APP1_HEADER), os.SEEK_CUR)
+        else:
+            f.seek(length, os.SEEK_CUR)
+
+def readEmbeddedXmp(imageFullPathWithName):
+    # Get the <x:xmpmeta> element embedded in an image, or None
+    # JPEGs are read segment by segment, other files are searched through a
+    # memory map, bounded to the first and last EMBEDDED_XMP_WINDOW bytes
+    countFs('read')
+    with open(imageFullPathWithName, 'rb') as f:
+        if f.read(2) == b'\xff\xd8':
+            f.seek(0)
+            packet = scanJpegXmp(f)
+            if packet is None:
+                return None
+            start = packet.find(XMP_START)
+            end = packet.find(XMP_END, start)
+            if start == -1 or end == -1:
+                return None
+            return packet[start:end+len(XMP_END)]
+
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for windowStart in sorted({0, max(0, size - EMBEDDED_XMP_WINDOW)}):
+                windowEnd = min(size, windowStart + EMBEDDED_XMP_WINDOW)
+                start = data.find(XMP_START, windowStart, windowEnd)
+                if start == -1:
+                    continue
+                end = data.find(XMP_END, start, windowEnd)
+                if end != -1:
+                    return data[start:end+len(XMP_END)]
+    return None
+
+def readImageMetadata(imageFullPathWithName, sidecars):
+    # Read image metadata from sidecar XMP file first, then from embedded XMP
     # Apple Metadata is even more unreliable than first thought.
     # The description in the image file might be absent when it's not.
     # But it also might be wrong. It might be a prior description or ??
     # So, we're always going to use sidecar, whose data is correct.
     #
-    # First, try to find and read sidecar XMP file
-    base_path = os.path.splitext(imageFullPathWithName)[0]
-    sidecar_patterns = [
-        f"{base_path}.xmp",
-        f"{base_path}.XMP",
-    ]
-
-    for sidecar_path in sidecar_patterns:
-        if os.path.exists(sidecar_path):
-            try:
-                with open(sidecar_path, 'r', encoding='utf-8') as f:
-                    xmp_str = f.read()
-
-                root = ET.fromstring(xmp_str)
-                ns = {
-                    'dc': 'http://purl.org/dc/elements/1.1/',
-                    'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
-                }
-
-                def get_text(tag):
-                    # First try direct text element
-                    el = root.find(f'.//dc:{tag}', ns)
-                    if el is not None and el.text:
-                        return el.text.strip()
-
-                    # Fall back to rdf:Alt/rdf:li structure
-                    el = root.find(f'.//dc:{tag}/rdf:Alt/rdf:li', ns)
-                    return el.text.strip() if el is not None and el.text else ""
-
-                title = get_text('description')
-                description = get_text('title')
-
-                if title is None and description is None:
-                    title = ''
-                    fullTitle = ''
-                else:
-                    if title is None:
-                        title = description
-                    else:
-                        fullTitle = title + ', on ' + description
-
-                return {
-                    'title': title,
-                    'fullTitle': fullTitle
-                }
-            except Exception:
-                continue
+    # First, try to read sidecar XMP file
+    for sidecar_path in sidecars:
+        try:
+            countFs('read')
+            with open(sidecar_path, 'r', encoding='utf-8') as f:
+                xmp_str = f.read()
+            return parseXmpMetadata(xmp_str)
+        except Exception:
+            continue
 
-    # No sidecar file found, use ORIGINAL embedded XMP logic
-    XMP_START = b'<x:xmpmeta'
-    XMP_END = b'</x:xmpmeta>'
+    # No sidecar file found, use the XMP packet embedded in the image
     try:
-        with open(imageFullPathWithName, 'rb') as f:
-            data = f.read()
-        start = data.find(XMP_START)
-        end = data.find(XMP_END)
-
-        if start == -1 or end == -1:
-            return {
-                'title': '',
-                'fullTitle': ''
-            }
+        xmp_bytes = readEmbeddedXmp(imageFullPathWithName)
+        if xmp_bytes is None:
+            return emptyImageMetadata()
 
-        xmp_bytes = data[start:end+len(XMP_END)]
         try:
             xmp_str = xmp_bytes.decode('utf-8', errors='ignore')
-            root = ET.fromstring(xmp_str)
+            return parseXmpMetadata(xmp_str, sidecar=False)
         except Exception:
-            return {
-                'title': '',
-                'fullTitle': ''
-            }
-
-        ns = {
-            'dc': 'http://purl.org/dc/elements/1.1/',
-            'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
-        }
-
-        def get_text(tag):
-            el = root.find(f'.//dc:{tag}/rdf:Alt/rdf:li', ns)
-            return el.text.strip() if el is not None and el.text else ""
-
-        title = get_text('description')
-        description = get_text('title')
-        if title is None and description is None:
-            title = ''
-            fullTitle = ''
-        else:
-            if title is None:
-                title = description
-            else:
-                fullTitle = title + ', on ' + description
-
-        return {
-            'title': title,
-            'fullTitle': fullTitle
-        }
+            return emptyImageMetadata()
     except Exception as e:
-        return {
-            'title': '',
-            'fullTitle': ''
-        }
-
-def getRandomImage(folderPath):
-    # Get a random image from a folder to use as folder thumbnail
-    images = []
+        return emptyImageMetadata()
 
-    # First check current directory
-    for item in os.listdir(folderPath):
-        itemFullPathWithName = os.path.join(folderPath, item)
-        if os.path.isfile(itemFullPathWithName) and isImage(item):
-            images.append(os.path.join(os.path.relpath(folderPath, app.config['CONTENT_FOLDER']), item))
-
-    # If no images in current directory, search subdirectories recursively
-    if not images:
-        for root, dirs, files in os.walk(folderPath):
-            for file in files:
-                if isImage(file):
-                    relPath = os.path.relpath(os.path.join(root, file), app.config['CONTENT_FOLDER'])
-                    images.append(relPath)
-                    break  # Found one image, no need to continue in this subdirectory
-            if images:
-                break  # Found at least one image, no need to search further
-
-    # If still no images found, return a default folder icon
+def getImageMetadata(imageFullPathWithName, sidecars=None):
+    # Get image metadata, from the metadata cache when the source file is unchanged
+    # Image path is full disk path to image
+    # Sidecars, when given, are the sidecar paths the content index found for it
+    return refreshImageMetadata(imageFullPathWithName, sidecars)[0]
+
+def refreshImageMetadata(imageFullPathWithName, sidecars=None, force=False):
+    # Get image metadata and whether it had to be parsed, re-parsing stale or forced entries
+    if sidecars is None:
+        base_path = os.path.splitext(imageFullPathWithName)[0]
+        sidecars = []
+        for path in (f"{base_path}.xmp", f"{base_path}.XMP"):
+            countFs('exists')
+            if os.path.exists(path):
+                sidecars.append(path)
+
+    # The cache entry is valid while the file we read it from keeps its mtime and size
+    source = sidecars[0] if sidecars else imageFullPathWithName
+    try:
+        countFs('stat')
+        stat = os.stat(source)
+    except OSError:
+        return emptyImageMetadata(), False
+
+    key = os.path.relpath(imageFullPathWithName, app.config['CONTENT_FOLDER']).replace(os.sep, '/')
+    sourceKey = os.path.relpath(source, app.config['CONTENT_FOLDER']).replace(os.sep, '/')
+    cached = lookupImageMetadata(key)
+    if not force and cached and cached['source'] == sourceKey and cached['mtime'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+        return cached['metadata'], False
+
+    metadata = readImageMetadata(imageFullPathWithName, sidecars)
+    storeImageMetadata(key, sourceKey, stat.st_mtime_ns, stat.st_size, metadata)
+    return metadata, True
+
+# Folder covers are picked from the content index whenever it changes
+folderCovers = {
+    'version': -1,                                                  # Content index version the table was built from
+    'candidates': {}                                                # Folder key -> relative image paths
+}
+folderCoversLock = threading.Lock()
+
+def buildFolderCovers():
+    # Work out the cover candidates of every folder: its own images, or failing
+    # that the images of the first folder below it that has any
+    folders = contentIndex['folders']
+    candidates = {}
+
+    def collect(folderKey):
+        if folderKey in candidates:
+            return candidates[folderKey]
+        node = folders.get(folderKey)
+        found = []
+        if node:
+            if node['images']:
+                found = [f"{folderKey}/{name}" if folderKey else name for name in node['images']]
+            else:
+                for name in node['folders']:
+                    found = collect(f"{folderKey}/{name}" if folderKey else name)
+                    if found:
+                        break
+        candidates[folderKey] = found
+        return found
+
+    for folderKey in folders:
+        collect(folderKey)
+    return candidates
+
+def getFolderCover(folderPath):
+    # Get the image to use as a folder thumbnail
+    # The pick is deterministic, so pages stay byte-stable and cacheable: the
+    # first image, or with COVER_ROTATION 'daily' a different image each day
+    refreshContentIndex()
+    if folderCovers['version'] != contentIndex['version']:
+        with folderCoversLock:
+            if folderCovers['version'] != contentIndex['version']:
+                version = contentIndex['version']
+                folderCovers['candidates'] = buildFolderCovers()
+                folderCovers['version'] = version
+
+    folderKey = contentKey(folderPath)
+    images = folderCovers['candidates'].get(folderKey) if folderKey is not None else None
+
+    # If no images found, return a default folder icon
     if not images:
         return "/static/img/folder-icon.png"
 
-    # Return a random image from the list
-    return random.choice(images)
+    if app.config['COVER_ROTATION'] == 'daily':
+        # crc32 rather than hash(), which differs between gunicorn workers
+        day = int(time.time() // 86400)
+        return images[(zlib.crc32(folderKey.encode('utf-8')) + day) % len(images)]
+    return images[0]
 
 def isImage(filename):
     # Check if a file is an image based on extension
@@ -747,6 +2221,155 @@ def isImage(filename):
     _, ext = os.path.splitext(filename.lower())
     return ext in image_extensions
 
+def isDerivable(filename):
+    # Check if we can make resized copies of a file (not videos)
+    derivable_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
+    _, ext = os.path.splitext(filename.lower())
+    return ext in derivable_extensions
+
+# ##########################################################
+# Image derivative functions
+# ##########################################################
+# Gallery grids show resized copies (derivatives) of the content images.
+# They are made on first request and kept in DERIVATIVES_FOLDER, which
+# mirrors the content tree: <width>/<content path>.<format>
+#
+# A derivative's mtime is set to its source's mtime, so any change to the
+# source makes it stale. Its atime is set whenever it is served and drives
+# LRU eviction once the folder grows past DERIVATIVES_MAX_BYTES.
+derivativeFormats = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})
+}
+derivativeState = {
+    'bytes': None                                                   # Approximate cache size, None until measured
+}
+derivativeLock = threading.Lock()
+DERIVATIVE_TOUCH_INTERVAL = 3600                                    # Seconds between LRU touches of one derivative
+
+def buildDerivative(sourcePath, derivativePath, width, fmt, sourceMtime):
+    # Resize one image to width and write it atomically in the given format
+    pillowFormat, options = derivativeFormats[fmt]
+    os.makedirs(os.path.dirname(derivativePath), exist_ok=True)
+
+    with Image.open(sourcePath) as img:
+        # Let JPEGs decode at a reduced scale that still covers width in either orientation
+        img.draft('RGB', (width, width))
+        img = ImageOps.exif_transpose(img)
+        if img.width > width:
+            img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+        if fmt == 'jpeg' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        elif fmt == 'webp' and img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+
+        tmpPath = f"{derivativePath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            img.save(tmpPath, pillowFormat, **options)
+            os.replace(tmpPath, derivativePath)
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+
+    os.utime(derivativePath, ns=(time.time_ns(), sourceMtime))
+    return os.path.getsize(derivativePath)
+
+def evictDerivatives():
+    # Measure the derivative cache and delete the least recently used files
+    # until it is back under 90% of DERIVATIVES_MAX_BYTES
+    files = []
+    total = 0
+    for root, _, names in os.walk(app.config['DERIVATIVES_FOLDER']):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_atime_ns, path, stat.st_size))
+            total += stat.st_size
+
+    if total > app.config['DERIVATIVES_MAX_BYTES']:
+        target = app.config['DERIVATIVES_MAX_BYTES'] * 0.9
+        evicted = 0
+        for _, path, size in sorted(files):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+            if total <= target:
+                break
+        logger.info(f"[INFO] Evicted {evicted} derivatives, cache now {total} bytes")
+
+    derivativeState['bytes'] = total
+
+def getDerivative(relativePathWithName, width, fmt):
+    # Get the path of a derivative within DERIVATIVES_FOLDER, making it if needed
+    # Returns None if there can be no such derivative
+    return refreshDerivative(relativePathWithName, width, fmt)[0]
+
+def refreshDerivative(relativePathWithName, width, fmt, force=False):
+    # Get the derivative path and whether it had to be built, rebuilding stale or forced ones
+    if width not in app.config['DERIVATIVE_WIDTHS'] or fmt not in derivativeFormats or not isDerivable(relativePathWithName):
+        return None, False
+    sourceKey = contentKey(relativePathWithName)
+    if not sourceKey:
+        return None, False
+
+    sourcePath = os.path.join(app.config['CONTENT_FOLDER'], sourceKey)
+    try:
+        countFs('stat')
+        sourceStat = os.stat(sourcePath)
+    except OSError:
+        return None, False
+
+    derivativeName = f"{width}/{sourceKey}.{fmt}"
+    derivativePath = os.path.join(app.config['DERIVATIVES_FOLDER'], derivativeName)
+    try:
+        countFs('stat')
+        stat = os.stat(derivativePath)
+        if not force and stat.st_mtime_ns == sourceStat.st_mtime_ns:
+            # Fresh, just record the use for LRU eviction
+            now = time.time_ns()
+            if now - stat.st_atime_ns > DERIVATIVE_TOUCH_INTERVAL * 1_000_000_000:
+                os.utime(derivativePath, ns=(now, stat.st_mtime_ns))
+            return derivativeName, False
+    except OSError:
+        pass
+
+    with derivativeLock:
+        size = buildDerivative(sourcePath, derivativePath, width, fmt, sourceStat.st_mtime_ns)
+        if derivativeState['bytes'] is None:
+            evictDerivatives()
+        else:
+            derivativeState['bytes'] += size
+            if derivativeState['bytes'] > app.config['DERIVATIVES_MAX_BYTES']:
+                evictDerivatives()
+    return derivativeName, True
+
+@app.template_filter('derivative')
+def derivative_filter(filename, width=640, fmt='jpeg', version=None):
+    # Versioned URL of a resized copy of a content image, or the original if it can't be resized
+    if not isDerivable(filename):
+        return versioned_url('serveContent', filename=filename)
+    sourceKey = contentKey(filename)
+    if version is None and sourceKey:
+        version = getAssetVersion(os.path.join(app.config['CONTENT_FOLDER'], sourceKey))
+    if version:
+        return url_for('serveDerivative', width=width, filename=f"{filename}.{fmt}", v=version)
+    return url_for('serveDerivative', width=width, filename=f"{filename}.{fmt}")
+
+@app.template_filter('srcset')
+def srcset_filter(filename, fmt='jpeg'):
+    # srcset attribute value listing every derivative width of a content image
+    if not isDerivable(filename):
+        return ''
+    sourceKey = contentKey(filename)
+    version = getAssetVersion(os.path.join(app.config['CONTENT_FOLDER'], sourceKey)) if sourceKey else None
+    return ', '.join(f"{derivative_filter(filename, width, fmt, version)} {width}w" for width in app.config['DERIVATIVE_WIDTHS'])
+
 # ##########################################################
 # Path processing functions
 # ##########################################################
@@ -767,11 +2390,11 @@ def buildBreadcrumbs(path):
     return breadcrumbs
 
 def getFolderContents(itemRelativePath):
-    # Get contents of a folder
-    itemFullPath = os.path.join(app.config['CONTENT_FOLDER'], itemRelativePath)          # Full path of Folder
+    # Get contents of a folder from the content index
+    node = getContentFolder(itemRelativePath)
 
     # Check if path exists and is a directory
-    if not os.path.exists(itemFullPath) or not os.path.isdir(itemFullPath):
+    if node is None:
         return None
 
     contents = {
@@ -779,45 +2402,37 @@ def getFolderContents(itemRelativePath):
         'images': []
     }
 
-    # Get all items in the directory
-    items = os.listdir(itemFullPath)                                        # Items may contain folders and images
+    itemFullPath = node['fullPath']                                        # Full path of Folder
 
-    for item in items:
-        itemFullPathWithName = os.path.join(itemFullPath, item)
-        # Skip about.txt and keywords.txt
-        if item in ['about.txt', 'keywords.txt']:
-            continue
+    for item in node['folders']:
+        # This is a subfolder
+        thumbnail = getFolderCover(os.path.join(itemFullPath, item))
+        contents['folders'].append({
+            'name': item,
+            'path': os.path.join(itemRelativePath, item),
+            'thumbnail': thumbnail
+        })
 
-        if os.path.isdir(itemFullPathWithName):
-            # This is a subfolder
-            thumbnail = getRandomImage(itemFullPathWithName)
-            contents['folders'].append({
-                'name': item,
-                'path': os.path.join(itemRelativePath, item),
-                'thumbnail': thumbnail
-            })
-        elif isImage(item):
-            # This is an image
-            # Relative path is the path relative to the content folder
-
-            metadata = getImageMetadata(itemFullPathWithName)               # Image Full Path (with name)
-            # item:                 Nord.png
-            # relativePath:         Nord
-            # relativePathWithName: Nord/Nord.png
-            # itemFullPath:         /Users/me/current/content/Nord
-            # itemFullPathWithName: /Users/me/current/content/Nord/Nord.png
-            contents['images'].append({
-                'name': item,                                               # Image Name (only)
-                'relativePath': itemRelativePath,                           # Relative (not full) path (without name)
-                'relativePathWithName': "/".join([itemRelativePath, item]) if itemRelativePath else item, # Relative (not full) path with name
-                'fullPathWithName': itemFullPathWithName,                   # Full path with name
-                'metadata': metadata                                        # Contains Title and Description
-            })
+    for item in node['images']:
+        # This is an image
+        # Relative path is the path relative to the content folder
+        itemFullPathWithName = os.path.join(itemFullPath, item)
 
-    # Sort folders and images alphabetically by name
-    contents['folders'].sort(key=lambda x: x['name'].lower())
-    contents['images'].sort(key=lambda x: x['name'].lower())
+        metadata = getImageMetadata(itemFullPathWithName, node['sidecars'].get(item, []))    # Image Full Path (with name)
+        # item:                 Nord.png
+        # relativePath:         Nord
+        # relativePathWithName: Nord/Nord.png
+        # itemFullPath:         /Users/me/current/content/Nord
+        # itemFullPathWithName: /Users/me/current/content/Nord/Nord.png
+        contents['images'].append({
+            'name': item,                                               # Image Name (only)
+            'relativePath': itemRelativePath,                           # Relative (not full) path (without name)
+            'relativePathWithName': "/".join([itemRelativePath, item]) if itemRelativePath else item, # Relative (not full) path with name
+            'fullPathWithName': itemFullPathWithName,                   # Full path with name
+            'metadata': metadata                                        # Contains Title and Description
+        })
 
+    # Folders and images are already sorted alphabetically by name in the index
     return contents
 
 def getClientIP():
@@ -829,29 +2444,284 @@ def getClientIP():
         ip = request.remote_addr
     return ip
 
+# ##########################################################
+# Page cache functions
+# ##########################################################
+# Gallery pages only change when the content does, so rendered pages are
+# kept per worker, keyed by host and path, and dropped whenever the content
+# index fingerprint (or the day, with daily cover rotation) changes. Query
+# arguments are left out of the key unless listed in PAGE_CACHE_ARGS, so
+# made-up ones can't push real pages out. With PAGE_CACHE_FOLDER set, pages
+# are also shared between workers on disk, in a subfolder named after that
+# same token, and evicted least recently used past PAGE_CACHE_MAX_BYTES.
+# Workers notice a content change up to CONTENT_INDEX_TTL apart, so the
+# folders of other tokens are only swept once nobody has written to them
+# for PAGE_CACHE_STALE_AGE.
+PAGE_CACHE_ARGS = []                                                # Query arguments gallery pages read, none so far
+PAGE_CACHE_TOUCH_INTERVAL = 600                                     # Seconds between LRU touches of one page file
+PAGE_CACHE_STALE_AGE = 300                                          # Seconds since its last write before another token's folder is deleted
+PAGE_CACHE_SWEEP_INTERVAL = 60                                      # Seconds between sweeps of stale token folders per worker
+pageCache = {
+    'deploy': None,                                                 # Fingerprint of the templates, static files and code
+    'token': None,                                                  # Deploy, content fingerprint and day the pages belong to
+    'pages': OrderedDict(),                                         # Page key -> rendered HTML, least recently used first
+    'diskBytes': None,                                              # Approximate size of the shared tier, None until measured
+    'swept': 0.0                                                    # When this worker last swept stale token folders
+}
+pageCacheLock = threading.Lock()
+pageCacheDiskLock = threading.Lock()
+
+def getDeployFingerprint():
+    # Templates, static files and code only change with a deploy, which restarts
+    # the workers, so this is worked out once per worker
+    if pageCache['deploy'] is None:
+        fingerprint = hashlib.sha1()
+        paths = [os.path.abspath(__file__)]
+        for folder in (os.path.join(app.root_path, app.template_folder), app.static_folder):
+            for root, _, files in os.walk(folder):
+                paths.extend(os.path.join(root, name) for name in files)
+        for path in sorted(paths):
+            try:
+                fingerprint.update(f"{path}\0{os.stat(path).st_mtime_ns}\0".encode('utf-8', 'surrogateescape'))
+            except OSError:
+                continue
+        pageCache['deploy'] = fingerprint.hexdigest()[:8]
+    return pageCache['deploy']
+
+def getPageCacheToken():
+    # Identify the code and content state a rendered page depends on
+    refreshContentIndex()
+    day = int(time.time() // 86400) if app.config['COVER_ROTATION'] == 'daily' else 0
+    return f"{getDeployFingerprint()}-{contentIndex['fingerprint']}-{day}"
+
+def readCachedPageFile(token, key):
+    # Get a page another worker rendered, if the shared tier is enabled
+    if not app.config['PAGE_CACHE_FOLDER']:
+        return None
+    path = os.path.join(app.config['PAGE_CACHE_FOLDER'], token, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.html')
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            stat = os.fstat(f.fileno())
+            now = time.time_ns()
+            if now - stat.st_atime_ns > PAGE_CACHE_TOUCH_INTERVAL * 1_000_000_000:
+                os.utime(path, ns=(now, stat.st_mtime_ns))          # Record the use for LRU eviction
+            return f.read()
+    except OSError:
+        return None
+
+def evictCachedPageFiles(folder):
+    # Measure the shared tier and delete the least recently used pages
+    # until it is back under 90% of PAGE_CACHE_MAX_BYTES
+    files = []
+    total = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files.append((stat.st_atime_ns, path, stat.st_size))
+        total += stat.st_size
+
+    if total > app.config['PAGE_CACHE_MAX_BYTES']:
+        target = app.config['PAGE_CACHE_MAX_BYTES'] * 0.9
+        evicted = 0
+        for _, path, size in sorted(files):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+            if total <= target:
+                break
+        logger.info(f"[INFO] Evicted {evicted} cached pages, cache now {total} bytes")
+
+    pageCache['diskBytes'] = total
+
+def sweepCachedPageFolders(token):
+    # Delete the folders of other tokens no worker has written to for PAGE_CACHE_STALE_AGE.
+    # A worker still on an older token keeps its folder's mtime fresh, so neither
+    # side deletes the folder the other is using while the workers catch up.
+    pageCache['swept'] = time.time()
+    cutoff = pageCache['swept'] - PAGE_CACHE_STALE_AGE
+    for name in os.listdir(app.config['PAGE_CACHE_FOLDER']):
+        path = os.path.join(app.config['PAGE_CACHE_FOLDER'], name)
+        try:
+            if name == token or os.stat(path).st_mtime > cutoff:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        logger.info(f"[INFO] Removed stale page cache folder {name}")
+
+def writeCachedPageFile(token, key, html):
+    # Share a rendered page with the other workers, sweeping out older content states
+    if not app.config['PAGE_CACHE_FOLDER']:
+        return
+    folder = os.path.join(app.config['PAGE_CACHE_FOLDER'], token)
+    try:
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+            pageCache['diskBytes'] = None
+        if time.time() - pageCache['swept'] > PAGE_CACHE_SWEEP_INTERVAL:
+            sweepCachedPageFolders(token)
+        path = os.path.join(folder, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.html')
+        tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmpPath, 'w', encoding='utf-8') as f:
+            f.write(html)
+            size = f.tell()
+        os.replace(tmpPath, path)
+
+        with pageCacheDiskLock:
+            if pageCache['diskBytes'] is None:
+                evictCachedPageFiles(folder)
+            else:
+                pageCache['diskBytes'] += size
+                if pageCache['diskBytes'] > app.config['PAGE_CACHE_MAX_BYTES']:
+                    evictCachedPageFiles(folder)
+    except OSError as e:
+        logger.error(f"[ERROR] Page cache write failed: {str(e)}")
+
+def getPageCacheKey():
+    # Key the current page by host and path plus the query arguments it reads
+    key = request.host + request.path
+    args = [(name, value) for name in PAGE_CACHE_ARGS for value in request.args.getlist(name)]
+    if args:
+        key += '?' + urlencode(args)
+    return key
+
+def cachedPage(render):
+    # Get the page for the current URL, calling render() only on a cache miss
+    # render() may return None (e.g. folder not found), which is not cached
+    token = getPageCacheToken()
+    key = getPageCacheKey()
+    with pageCacheLock:
+        if pageCache['token'] != token:
+            pageCache['pages'].clear()
+            pageCache['token'] = token
+        html = pageCache['pages'].get(key)
+        if html is not None:
+            pageCache['pages'].move_to_end(key)
+            return html
+
+    html = readCachedPageFile(token, key)
+    if html is None:
+        html = render()
+        if html is None:
+            return None
+        writeCachedPageFile(token, key, html)
+
+    with pageCacheLock:
+        if pageCache['token'] == token:
+            pageCache['pages'][key] = html
+            while len(pageCache['pages']) > app.config['PAGE_CACHE_SIZE']:
+                pageCache['pages'].popitem(last=False)
+    return html
+
+# ##########################################################
+# Asset versioning functions
+# ##########################################################
+# Static files, content images and derivatives are linked with a ?v= version
+# token. A URL whose token matches the file is cached by browsers for a year
+# without revalidation; anything else gets ETag/Last-Modified revalidation.
+assetVersions = {}                                                  # Full path -> ((mtime, size), token)
+ASSET_HASH_LIMIT = 256 * 1024                                       # Larger files are versioned by mtime and size
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+def getAssetVersion(fullPath):
+    # Get the version token of a file, or None if it isn't a readable regular file
+    # Small files are content hashed, which only happens again when they change
+    try:
+        st = os.stat(fullPath)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):                                # e.g. the static folder itself for an empty filename
+        return None
+    signature = (st.st_mtime_ns, st.st_size)
+    cached = assetVersions.get(fullPath)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    if st.st_size <= ASSET_HASH_LIMIT:
+        try:
+            with open(fullPath, 'rb') as f:
+                token = hashlib.sha1(f.read()).hexdigest()[:12]
+        except OSError:
+            return None
+    else:
+        token = f"{st.st_mtime_ns:x}{st.st_size:x}"[-12:]
+    assetVersions[fullPath] = (signature, token)
+    return token
+
+def getAssetPath(endpoint, viewArgs):
+    # Full path of the file behind a versioned route, or None
+    filename = viewArgs.get('filename', '')
+    if endpoint == 'static':
+        return safe_join(app.static_folder, filename)
+    if endpoint == 'serveDerivative':
+        filename = filename.rpartition('.')[0]
+    if endpoint in ('serveContent', 'serveDerivative'):
+        key = contentKey(filename)
+        return os.path.join(app.config['CONTENT_FOLDER'], key) if key else None
+    return None
+
+@app.template_global()
+def versioned_url(endpoint, filename, **values):
+    # URL of a static or content file with its version token
+    path = getAssetPath(endpoint, {'filename': filename})
+    version = getAssetVersion(path) if path else None
+    if version:
+        values['v'] = version
+    return url_for(endpoint, filename=filename, **values)
+
+@app.after_request
+def addAssetCacheHeaders(response):
+    # Fingerprinted URLs are immutable, unfingerprinted ones must revalidate
+    if request.endpoint not in ('static', 'serveContent', 'serveDerivative') or response.status_code not in (200, 206, 304):
+        return response
+    path = getAssetPath(request.endpoint, request.view_args or {})
+    version = request.args.get('v')
+    response.cache_control.public = True
+    if version and path and version == getAssetVersion(path):
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
 # ##########################################################
 # Path processing application routes
 # ##########################################################
+def conditionalPage(html):
+    # Gallery pages are stable between content changes, so tag them with an
+    # ETag and answer repeat requests with 304 Not Modified
+    response = make_response(html)
+    response.add_etag()
+    return response.make_conditional(request)
+
 @app.route('/')
 def home():
     ip = getClientIP()
     logger.info(f"[INFO] Root Request From IP: {ip}")
     # Render the home page
-    contents = getFolderContents('')
-    page_meta = build_page_metadata('', contents)
-
-    return render_template('index.html',
-                          contents=contents,
-                          currentPath='',
-                          **page_meta)
+    return conditionalPage(cachedPage(lambda: renderFolderPage('')))
 
 @app.route('/folder/<path:folderPath>')
 def folder(folderPath):
     logger.info(f"[INFO] Get Folder: {folderPath}")
     # Setup a folder of images
+    html = cachedPage(lambda: renderFolderPage(folderPath))
+    if html is None:
+        return "Folder not found", 404
+    return conditionalPage(html)
+
+def renderFolderPage(folderPath):
+    # Render a gallery page, or return None if there is no such folder
     contents = getFolderContents(folderPath)
     if contents is None:
-        return "Folder not found", 404
+        return None
 
     page_meta = build_page_metadata(folderPath, contents)
 
@@ -865,28 +2735,208 @@ def folder(folderPath):
 def serveContent(filename):
     logger.info(f"[INFO] Get File: {filename}")
     # Serve files from the content directory
-    return send_from_directory(app.config['CONTENT_FOLDER'], filename)
+    # With CONTENT_DELIVERY set to 'x-accel' or 'x-sendfile' we only authorize
+    # the path and leave sending the bytes (ranges and all) to the front proxy
+    key = contentKey(filename)
+    fullPath = os.path.join(app.config['CONTENT_FOLDER'], key) if key else None
+    countFs('stat')
+    if not fullPath or not os.path.isfile(fullPath):
+        return "File not found", 404
+
+    delivery = app.config['CONTENT_DELIVERY']
+    if delivery in ('x-accel', 'x-sendfile'):
+        response = Response(mimetype=mimetypes.guess_type(fullPath)[0] or 'application/octet-stream')
+        if delivery == 'x-accel':
+            response.headers['X-Accel-Redirect'] = app.config['CONTENT_ACCEL_PREFIX'].rstrip('/') + '/' + quote(key)
+        else:
+            response.headers['X-Sendfile'] = fullPath
+        return response
+
+    # Werkzeug handles Range, If-Range, ETag and Last-Modified, and whole files
+    # go out through wsgi.file_wrapper, which gunicorn sends with sendfile()
+    response = send_file(fullPath, conditional=True)
+    if response.status_code == 206:
+        response = sendfileRange(response, fullPath)
+    return response
+
+def sendfileRange(response, fullPath):
+    # Werkzeug sends a single byte range by reading it through Python. Gunicorn's
+    # file wrapper sends Content-Length bytes from the file's current offset with
+    # sendfile(), so hand it the file positioned at the start of the range.
+    fileWrapper = request.environ.get('wsgi.file_wrapper')
+    if not fileWrapper or not request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+        return response
+    contentRange = response.content_range
+    if contentRange is None or contentRange.start is None:
+        return response
+
+    f = open(fullPath, 'rb')
+    f.seek(contentRange.start)
+    response.response.close()
+    response.response = fileWrapper(f)
+    return response
+
+# For resized copies of content images
+@app.route('/derivatives/<int:width>/<path:filename>')
+def serveDerivative(width, filename):
+    # Filename is the content path plus the format, e.g. Nord/Nord.png.webp
+    sourceName, _, fmt = filename.rpartition('.')
+    try:
+        derivativeName = getDerivative(sourceName, width, fmt)
+    except Exception as e:
+        # Fall back to the original rather than show a broken tile
+        logger.error(f"[ERROR] Derivative failed: {filename}: {str(e)}")
+        return redirect(url_for('serveContent', filename=sourceName))
+
+    if derivativeName is None:
+        return "Image not found", 404
+    return send_from_directory(app.config['DERIVATIVES_FOLDER'], derivativeName)
 
 # ##########################################################
 # Comments processing application routes and functions
 # ##########################################################
+# Comment badges on a folder grid read commentCounts, kept current by triggers
+# on comments, so a whole grid costs one request and one indexed query.
+COMMENT_COUNTS_LIMIT = 500                                          # Images per counts request
+COMMENT_COUNTS_SCHEMA = [                                           # Counts table, sync triggers and initial fill
+    """CREATE TABLE IF NOT EXISTS commentCounts (
+        imageName TEXT PRIMARY KEY,
+        count INTEGER NOT NULL,
+        latest TIMESTAMP
+    ) WITHOUT ROWID""",
+    """CREATE TRIGGER IF NOT EXISTS commentCountsInsert AFTER INSERT ON comments BEGIN
+        INSERT INTO commentCounts(imageName, count, latest) VALUES (new.imageName, 1, new.created)
+        ON CONFLICT(imageName) DO UPDATE SET count = count + 1, latest = max(latest, excluded.latest);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS commentCountsDelete AFTER DELETE ON comments BEGIN
+        UPDATE commentCounts SET count = count - 1,
+            latest = (SELECT max(created) FROM comments WHERE imageName = old.imageName)
+        WHERE imageName = old.imageName;
+        DELETE FROM commentCounts WHERE imageName = old.imageName AND count <= 0;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS commentCountsUpdate AFTER UPDATE OF imageName, created ON comments BEGIN
+        UPDATE commentCounts SET count = count - 1,
+            latest = (SELECT max(created) FROM comments WHERE imageName = old.imageName)
+        WHERE imageName = old.imageName;
+        DELETE FROM commentCounts WHERE imageName = old.imageName AND count <= 0;
+        INSERT INTO commentCounts(imageName, count, latest) VALUES (new.imageName, 1, new.created)
+        ON CONFLICT(imageName) DO UPDATE SET count = count + 1, latest = max(latest, excluded.latest);
+    END""",
+    "DELETE FROM commentCounts",
+    """INSERT INTO commentCounts(imageName, count, latest)
+        SELECT imageName, COUNT(*), MAX(created) FROM comments GROUP BY imageName"""
+]
+
+def lookupCommentCounts(imageNames):
+    # Get the comment count and latest comment time of each image, in one query
+    counts = {name: {'count': 0, 'latest': None} for name in imageNames}
+    conn = getDataDB()
+    rows = conn.execute("""
+        SELECT imageName, count, latest
+        FROM commentCounts
+        WHERE imageName IN (SELECT value FROM json_each(?))
+    """, (json.dumps(list(counts)),))
+    for row in rows:
+        counts[row['imageName']] = {'count': row['count'], 'latest': row['latest']}
+    return counts
+
+@app.route('/comments/counts', methods=['GET', 'POST'])
+def getCommentCounts():
+    # Get comment counts for every image of a folder (?folder=), or for a list of images
+    # (?image= repeated, or a JSON body {"images": [...]})
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            imageNames = data.get('images', [])
+        elif 'folder' in request.args:
+            folderPath = request.args.get('folder', '').strip('/')
+            node = getContentFolder(folderPath)
+            if node is None:
+                return jsonify({'success': False, 'error': 'Folder not found'}), 404
+            imageNames = ["/".join([folderPath, item]) if folderPath else item for item in node['images']]
+        else:
+            imageNames = request.args.getlist('image')
+
+        if not isinstance(imageNames, list) or not all(isinstance(name, str) for name in imageNames):
+            return jsonify({'success': False, 'error': 'Images must be a list of names'}), 400
+        if len(imageNames) > COMMENT_COUNTS_LIMIT:
+            return jsonify({'success': False, 'error': f'At most {COMMENT_COUNTS_LIMIT} images per request'}), 400
+
+        return jsonify({'success': True, 'counts': lookupCommentCounts(imageNames)})
+    except Exception as e:
+        logger.error(f"Error fetching comment counts: {str(e)}")
+        return jsonify({'success': False, 'error': 'Error loading comment counts'}), 500
+
+# Comment page queries, also explained by check-queries
+COMMENTS_NEWEST_QUERY = """
+    SELECT id, imageName, author, comment, created
+    FROM comments
+    WHERE imageName = ?
+    ORDER BY created DESC, id DESC
+    LIMIT ?
+"""
+COMMENTS_OLDER_QUERY = """
+    SELECT id, imageName, author, comment, created
+    FROM comments
+    WHERE imageName = ? AND (created, id) < (?, ?)
+    ORDER BY created DESC, id DESC
+    LIMIT ?
+"""
+COMMENTS_NEWER_QUERY = """
+    SELECT id, imageName, author, comment, created
+    FROM comments
+    WHERE imageName = ? AND (created, id) > (?, ?)
+    ORDER BY created ASC, id ASC
+    LIMIT ?
+"""
+
+def fetchComments(imageName, limit, before=None, since=None):
+    # Get up to limit comments of an image, newest first, older than the before cursor or
+    # newer than the since cursor. Returns the comments and whether more remain that way.
+    conn = getDataDB()
+    if since:
+        rows = conn.execute(COMMENTS_NEWER_QUERY, (imageName, since[0], since[1], limit + 1)).fetchall()
+    elif before:
+        rows = conn.execute(COMMENTS_OLDER_QUERY, (imageName, before[0], before[1], limit + 1)).fetchall()
+    else:
+        rows = conn.execute(COMMENTS_NEWEST_QUERY, (imageName, limit + 1)).fetchall()
+
+    comments = [dict(row) for row in rows[:limit]]
+    if since:
+        comments.reverse()
+    return comments, len(rows) > limit
+
+def getCommentsPageSize():
+    # Get the requested comments page size, within limits
+    return min(max(request.args.get('limit', commentsPerPage, type=int), 1), commentsPageLimit)
+
 @app.route('/comments/<path:imageName>')
 def getComments(imageName):
-    # Get comments for an image (AJAX endpoint)
+    # Get comments for an image (AJAX endpoint), a page at a time.
+    # ?before=<next_cursor> pages back through older comments, ?since=<since_cursor>
+    # polls for comments newer than the ones the client already has.
     # Decode URL encoding to handle special characters
     imageName = unquote(imageName)
     logger.info(f"[INFO] Get Comments: {imageName}")
     try:
-        conn = getDataDB()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT imageName, author, comment, created
-            FROM comments
-            WHERE imageName = ?
-            ORDER BY created DESC
-        """, (imageName,))
-        comments = [dict(row) for row in cur.fetchall()]
-        return jsonify({'comments': comments})
+        since_token = request.args.get('since')
+        since = decodeCursor(since_token)
+        before = decodeCursor(request.args.get('before'))
+        comments, has_more = fetchComments(imageName, getCommentsPageSize(), before, since)
+
+        if since:
+            # Newer comments come oldest first in pages, poll again from the newest one
+            next_cursor = None
+            since_cursor = encodeCursor(comments[0], 'created') if comments else since_token
+        else:
+            next_cursor = encodeCursor(comments[-1], 'created') if has_more else None
+            since_cursor = encodeCursor(comments[0], 'created') if comments else None
+        return jsonify({
+            'comments': comments,
+            'has_more': has_more,
+            'next_cursor': next_cursor,
+            'since_cursor': since_cursor
+        })
     except Exception as e:
         logger.error(f"[ERROR] getComments failed: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -907,7 +2957,6 @@ def postComment():
             VALUES (?, ?, ?)
         """, (imageName, author, comment))
         conn.commit()
-        conn.close()
 
         logger.info(f"[INFO] Comment: {imageName} {author} {comment}")
         return jsonify({'success': True})
@@ -923,27 +2972,22 @@ def getCommentsModal(imageName):
     imageTitle = request.args.get('title', imageName)
 
     try:
-        conn = getDataDB()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT imageName, author, comment, created
-            FROM comments
-            WHERE imageName = ?
-            ORDER BY created DESC
-        """, (imageName,))
-        comments = [dict(row) for row in cur.fetchall()]
-        conn.close()
+        before = decodeCursor(request.args.get('before'))
+        comments, has_more = fetchComments(imageName, getCommentsPageSize(), before)
 
         return render_template('comments.html',
                              comments=comments,
                              imageName=imageName,
-                             imageTitle=imageTitle)
+                             imageTitle=imageTitle,
+                             olderCursor=encodeCursor(comments[-1], 'created') if has_more else None,
+                             isNewest=before is None)
     except Exception as e:
         logger.error(f"[ERROR] getCommentsModal failed: {str(e)}")
         return render_template('comments.html',
                              comments=[],
                              imageName=imageName,
                              imageTitle=imageTitle,
+                             isNewest=True,
                              error=str(e))
 
 @app.route('/comments/add', methods=['POST'])
@@ -962,7 +3006,6 @@ def addCommentServer():
             VALUES (?, ?, ?)
         """, (imageName, author, comment))
         conn.commit()
-        conn.close()
 
         # Redirect back to the modal with success message
         return redirect(url_for('getCommentsModal',
@@ -982,10 +3025,13 @@ def addCommentServer():
 # ##########################################################
 @app.route('/blog')
 @app.route('/blog/<int:page>')
-def blog(page=1):
+def blog(page=None):
     ip = getClientIP()
     logger.info(f"[INFO] Blog Request From IP: {ip}")
     per_page = postsPerPage
+    page = max(page or request.args.get('page', 1, type=int), 1)   # url_for puts the page in the query string
+    after = decodeCursor(request.args.get('after'))
+    before = decodeCursor(request.args.get('before'))
     search_query = request.args.get('search', '').strip()
     category_filter = request.args.get('category', '')
     province_filter = request.args.get('province', '')
@@ -1000,90 +3046,36 @@ def blog(page=1):
         conn = getDataDB()
         cursor = conn.cursor()
 
-        # Test basic query first
-        cursor.execute("SELECT * FROM blogs LIMIT 1")
-
-        # Fetch filter options with counts for better UX
-        cursor.execute("""
-            SELECT category, COUNT(*) as count
-            FROM blogs
-            WHERE category IS NOT NULL
-            GROUP BY category
-            ORDER BY category
-        """)
-        categories = [{'name': row['category'], 'count': row['count']} for row in cursor.fetchall()]
-
-        cursor.execute("""
-            SELECT province, COUNT(*) as count
-            FROM blogs
-            WHERE province IS NOT NULL
-            GROUP BY province
-            ORDER BY province
-        """)
-        provinces = [{'name': row['province'], 'count': row['count']} for row in cursor.fetchall()]
-
-        cursor.execute("""
-            SELECT city, COUNT(*) as count
-            FROM blogs
-            WHERE city IS NOT NULL
-            GROUP BY city
-            ORDER BY city
-        """)
-        cities = [{'name': row['city'], 'count': row['count']} for row in cursor.fetchall()]
-
-        cursor.execute("""
-            SELECT author, COUNT(*) as count
-            FROM blogs
-            WHERE author IS NOT NULL
-            GROUP BY author
-            ORDER BY author
-        """)
-        authors = [{'name': row['author'], 'count': row['count']} for row in cursor.fetchall()]
-
-        # Build dynamic query with better search functionality
-        query = "SELECT * FROM blogs WHERE 1=1"
-        params = []
-
-        if search_query:
-            # Enhanced search with ranking
-            query += " AND (title LIKE ? OR content LIKE ? OR excerpt LIKE ? OR author LIKE ?)"
-            search_term = f'%{search_query}%'
-            params.extend([search_term, search_term, search_term, search_term])
-
-        if category_filter:
-            query += " AND category = ?"
-            params.append(category_filter)
-        if province_filter:
-            query += " AND province = ?"
-            params.append(province_filter)
-        if city_filter:
-            query += " AND city = ?"
-            params.append(city_filter)
-        if author_filter:
-            query += " AND author = ?"
-            params.append(author_filter)
-
-        # Apply sorting with more options
-        sort_options = {
-            'title_asc': 'title ASC',
-            'title_desc': 'title DESC',
-            'date_asc': 'date ASC',
-            'date_desc': 'date DESC',
-            'author_asc': 'author ASC',
-            'author_desc': 'author DESC'
-        }
-        query += f" ORDER BY {sort_options.get(sort_by, 'date DESC')}"
-
-        # Count total posts
-        count_query = query.replace("SELECT *", "SELECT COUNT(*)")
-        cursor.execute(count_query, params)
-        total_posts = cursor.fetchone()[0]
-
-        # Fetch paginated posts
-        query += " LIMIT ? OFFSET ?"
-        params.extend([per_page, (page - 1) * per_page])
-        cursor.execute(query, params)
+        # Fetch filter options with counts drilled down by the active filters
+        search_match = buildSearchMatch(search_query) if search_query else None
+        facets = getBlogFacets(cursor, {
+            'category': category_filter,
+            'province': province_filter,
+            'city': city_filter,
+            'author': author_filter
+        }, search_match)
+
+        # Build the page query, searching through the full-text index
+        pageQuery = buildBlogQuery({
+            'category': category_filter,
+            'province': province_filter,
+            'city': city_filter,
+            'author': author_filter
+        }, search_query, search_match, sort_by, after, before, page, per_page)
+        column = pageQuery['column']
+
+        # Count total posts, the index answers the match without ranking or snippets
+        total_posts = getBlogTotal(cursor, pageQuery['count'], pageQuery['countParams'])
+
+        # Fetch the page, by keyset when the client sent a cursor
+        cursor.execute(pageQuery['query'], pageQuery['params'])
         posts = [dict(row) for row in cursor.fetchall()]
+        if before and not after and column:
+            posts.reverse()
+
+        total_pages = (total_posts + per_page - 1) // per_page
+        next_cursor = encodeCursor(posts[-1], column) if column and posts and page < total_pages else None
+        prev_cursor = encodeCursor(posts[0], column) if column and posts and page > 1 else None
 
         # Process posts for display with better image handling
         processed_posts = []
@@ -1109,16 +3101,15 @@ def blog(page=1):
                 'author': post.get('author', 'Unknown'),
                 'date': post['date'],
                 'excerpt': excerpt,
+                'snippet': formatSearchSnippet(post.get('snippet')),
                 'image': image_url,
                 'category': post.get('category', ''),
                 'province': post.get('province', ''),
                 'city': post.get('city', '')
             })
 
-        total_pages = (total_posts + per_page - 1) // per_page
-
         # Generate pagination data
-        pagination_data = generate_pagination_data(page, total_pages)
+        pagination_data = generate_pagination_data(page, total_pages, next_cursor, prev_cursor)
 
         # Prepare filter data
         filter_data = {
@@ -1146,9 +3137,12 @@ def blog(page=1):
                 'success': True,
                 'posts': processed_posts,
                 'pagination': pagination_data,
+                'facets': facets,
                 'total_posts': total_posts,
                 'page': page,
                 'total_pages': total_pages,
+                'next_cursor': next_cursor,
+                'prev_cursor': prev_cursor,
                 'filters': filter_data,
                 'metadata': metadata
             })
@@ -1159,10 +3153,7 @@ def blog(page=1):
                                  page=page,
                                  total_pages=total_pages,
                                  pagination=pagination_data,
-                                 categories=categories,
-                                 provinces=provinces,
-                                 cities=cities,
-                                 authors=authors,
+                                 **facets,
                                  total_posts=total_posts,
                                  **filter_data,
                                  **metadata)
@@ -1214,7 +3205,7 @@ def blog_post_detail(post_id):
     try:
         conn = getDataDB()
         cur = conn.cursor()
-        row = cur.execute("SELECT * FROM blogs WHERE id = ?", (post_id,)).fetchone()
+        row = cur.execute(BLOG_POST_QUERY, (post_id,)).fetchone()
 
         if not row:
             return jsonify({"success": False, "error": "Post not found"}), 404
@@ -1265,18 +3256,12 @@ def blog_filters():
         conn = getDataDB()
         cursor = conn.cursor()
 
-        # Get all filter options
-        cursor.execute("SELECT DISTINCT category FROM blogs WHERE category IS NOT NULL ORDER BY category")
-        categories = [row['category'] for row in cursor.fetchall()]
-
-        cursor.execute("SELECT DISTINCT province FROM blogs WHERE province IS NOT NULL ORDER BY province")
-        provinces = [row['province'] for row in cursor.fetchall()]
-
-        cursor.execute("SELECT DISTINCT city FROM blogs WHERE city IS NOT NULL ORDER BY city")
-        cities = [row['city'] for row in cursor.fetchall()]
-
-        cursor.execute("SELECT DISTINCT author FROM blogs WHERE author IS NOT NULL ORDER BY author")
-        authors = [row['author'] for row in cursor.fetchall()]
+        # Get all filter options from the maintained counts
+        facets = getBlogFacets(cursor, {})
+        categories = [facet['name'] for facet in facets['categories']]
+        provinces = [facet['name'] for facet in facets['provinces']]
+        cities = [facet['name'] for facet in facets['cities']]
+        authors = [facet['name'] for facet in facets['authors']]
 
         return jsonify({
             'success': True,
@@ -1298,22 +3283,15 @@ def serveDataImages(filename):
         if filename.startswith('..') or os.path.isabs(filename):
             logger.error(f"Invalid path attempted: {filename}")
             raise ValueError("Invalid file path")
-        # Try exact match first
-        full_path = os.path.join(app.config['IMAGES_FOLDER'], filename)
-        if os.path.exists(full_path) and os.path.isfile(full_path):
-            response = send_from_directory(app.config['IMAGES_FOLDER'], filename)
-            response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-            return response
-        # Try case-insensitive match
-        base_dir = app.config['IMAGES_FOLDER']
-        for root, _, files in os.walk(base_dir):
-            for f in files:
-                if f.lower() == filename.lower():
-                    rel_path = os.path.relpath(os.path.join(root, f), base_dir)
-                    response = send_from_directory(base_dir, rel_path)
-                    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-                    return response
-        raise FileNotFoundError(f"File {filename} not found")
+        # Exact or case-insensitive match from the images index, misses cost nothing
+        rel_path = findDataImage(filename)
+        if rel_path is None:
+            raise FileNotFoundError(f"File {filename} not found")
+        response = send_from_directory(app.config['IMAGES_FOLDER'], rel_path)
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['IMAGES_MAX_AGE']
+        return response
     except Exception as e:
         return "Image not found", 404
 
@@ -1541,7 +3519,7 @@ def build_blog_post_metadata(post):
         'schema_json': json.dumps(schema_data, indent=2)
     }
 
-def generate_pagination_data(current_page, total_pages):
+def generate_pagination_data(current_page, total_pages, next_cursor=None, prev_cursor=None):
     """Generate pagination data for template rendering with improved logic"""
     if total_pages <= 1:
         return {'pages': [], 'show_prev': False, 'show_next': False}
@@ -1568,7 +3546,7 @@ def generate_pagination_data(current_page, total_pages):
         pages.append({
             'number': 1,
             'is_current': False,
-            'url': url_for('blog', page=1, **{k: v for k, v in request.args.items() if k != 'page'})
+            'url': url_for('blog', page=1, **{k: v for k, v in request.args.items() if k not in ('page', 'after', 'before')})
         })
         if start_page > 2:
             pages.append({'ellipsis': True})
@@ -1578,7 +3556,7 @@ def generate_pagination_data(current_page, total_pages):
         pages.append({
             'number': i,
             'is_current': i == current_page,
-            'url': url_for('blog', page=i, **{k: v for k, v in request.args.items() if k != 'page'})
+            'url': url_for('blog', page=i, **{k: v for k, v in request.args.items() if k not in ('page', 'after', 'before')})
         })
 
     # Add last page and ellipsis if needed
@@ -1588,15 +3566,15 @@ def generate_pagination_data(current_page, total_pages):
         pages.append({
             'number': total_pages,
             'is_current': False,
-            'url': url_for('blog', page=total_pages, **{k: v for k, v in request.args.items() if k != 'page'})
+            'url': url_for('blog', page=total_pages, **{k: v for k, v in request.args.items() if k not in ('page', 'after', 'before')})
         })
 
     return {
         'pages': pages,
         'show_prev': current_page > 1,
         'show_next': current_page < total_pages,
-        'prev_url': url_for('blog', page=current_page - 1, **{k: v for k, v in request.args.items() if k != 'page'}) if current_page > 1 else None,
-        'next_url': url_for('blog', page=current_page + 1, **{k: v for k, v in request.args.items() if k != 'page'}) if current_page < total_pages else None
+        'prev_url': url_for('blog', page=current_page - 1, before=prev_cursor, **{k: v for k, v in request.args.items() if k not in ('page', 'after', 'before')}) if current_page > 1 else None,
+        'next_url': url_for('blog', page=current_page + 1, after=next_cursor, **{k: v for k, v in request.args.items() if k not in ('page', 'after', 'before')}) if current_page < total_pages else None
     }
 
 # ##########################################################
@@ -1700,6 +3678,141 @@ def delete_post(id):
         flash("Error deleting post. Please try again.", "error")
     return redirect(url_for('admin'))
 
+# ##########################################################
+# Command line functions
+# ##########################################################
+def initBuildWorker():
+    # Build workers are forked from the CLI process, so start with fresh metadata connections
+    metadataDBLocal.__dict__.clear()
+    derivativeState['bytes'] = None
+
+def buildGalleryImage(job):
+    # Build everything one image needs: its derivatives and its cached metadata
+    # Runs in a worker process, returns counts for the throughput report
+    relativePathWithName, sidecars, force = job
+    result = {
+        'derivativesBuilt': 0,
+        'derivativesSkipped': 0,
+        'metadataParsed': 0,
+        'metadataSkipped': 0,
+        'subjects': [],
+        'errors': []
+    }
+
+    if isDerivable(relativePathWithName):
+        for width in app.config['DERIVATIVE_WIDTHS']:
+            for fmt in derivativeFormats:
+                try:
+                    _, built = refreshDerivative(relativePathWithName, width, fmt, force)
+                    result['derivativesBuilt' if built else 'derivativesSkipped'] += 1
+                except Exception as e:
+                    result['errors'].append(f"{relativePathWithName} {width} {fmt}: {str(e)}")
+
+    try:
+        imageFullPathWithName = os.path.join(app.config['CONTENT_FOLDER'], relativePathWithName)
+        metadata, parsed = refreshImageMetadata(imageFullPathWithName, sidecars, force)
+        result['metadataParsed' if parsed else 'metadataSkipped'] += 1
+        result['subjects'] = metadata['subjects']
+    except Exception as e:
+        result['errors'].append(f"{relativePathWithName} metadata: {str(e)}")
+
+    return result
+
+@app.cli.command('build-gallery')
+@click.option('--workers', '-j', type=int, default=None, help='Worker processes (default: one per core)')
+@click.option('--force', is_flag=True, help='Rebuild derivatives and metadata even if they are up to date')
+def buildGallery(workers, force):
+    """Pre-generate derivatives and image metadata for the whole content tree."""
+    started = time.perf_counter()
+    refreshContentIndex(force=True)
+
+    jobs = []
+    keywords = set()
+    for folderKey, node in sorted(contentIndex['folders'].items()):
+        keywords.update(node['keywords'])
+        for name in node['images']:
+            jobs.append(("/".join([folderKey, name]) if folderKey else name, node['sidecars'].get(name, []), force))
+    scanned = time.perf_counter()
+
+    totals = {'derivativesBuilt': 0, 'derivativesSkipped': 0, 'metadataParsed': 0, 'metadataSkipped': 0}
+    subjects = set()
+    errors = []
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=initBuildWorker) as executor:
+        for done, result in enumerate(executor.map(buildGalleryImage, jobs, chunksize=8), 1):
+            for key in totals:
+                totals[key] += result[key]
+            subjects.update(result['subjects'])
+            errors.extend(result['errors'])
+            if done % 100 == 0:
+                click.echo(f"  {done}/{len(jobs)} images")
+
+    elapsed = time.perf_counter() - started
+    for error in errors:
+        click.echo(f"  ERROR {error}", err=True)
+    click.echo(f"Indexed {len(contentIndex['folders'])} folders and {len(jobs)} images in {scanned - started:.2f}s")
+    click.echo(f"Derivatives: {totals['derivativesBuilt']} built, {totals['derivativesSkipped']} up to date")
+    click.echo(f"Metadata:    {totals['metadataParsed']} parsed, {totals['metadataSkipped']} up to date")
+    click.echo(f"Keywords:    {len(keywords)} folder keywords, {len(subjects)} image subjects")
+    click.echo(f"Finished in {elapsed:.2f}s with {workers} workers: {len(jobs) / elapsed:.1f} images/s, "
+               f"{totals['derivativesBuilt'] / elapsed:.1f} derivatives/s, {len(errors)} errors")
+
+@app.cli.command('send-mail')
+def sendMail():
+    """Deliver every message due in the mail outbox, then exit."""
+    total = 0
+    while True:
+        claimed = sendQueuedMail()
+        total += claimed
+        if claimed < MAIL_BATCH_SIZE:
+            break
+    pending = getDataDB().execute("SELECT COUNT(*) FROM mailOutbox WHERE sent IS NULL").fetchone()[0]
+    click.echo(f"Handled {total} messages, {pending} waiting for a retry or given up")
+
+def getDataQueryChecks():
+    # The hot data queries, built the way the routes build them. Each must be answered
+    # through an index or the FTS5 table, and in index order unless it is ranked.
+    # Returns (name, query, params, ranked) tuples.
+    position = ('2024-01-01', 1)
+    checks = [
+        ('newest comments', COMMENTS_NEWEST_QUERY, ('IMG_0001.jpg', commentsPerPage + 1), False),
+        ('older comments', COMMENTS_OLDER_QUERY, ('IMG_0001.jpg', *position, commentsPerPage + 1), False),
+        ('newer comments', COMMENTS_NEWER_QUERY, ('IMG_0001.jpg', *position, commentsPerPage + 1), False),
+        ('blog post', BLOG_POST_QUERY, (1,), False)
+    ]
+    for sortBy in BLOG_SORTS:
+        first = buildBlogQuery({}, '', None, sortBy)
+        checks.append((f'posts {sortBy}', first['query'], first['params'], False))
+        for cursorName, keyset in (('after', {'after': position}), ('before', {'before': position})):
+            page = buildBlogQuery({}, '', None, sortBy, **keyset)
+            checks.append((f'posts {sortBy} {cursorName} cursor', page['query'], page['params'], False))
+    for column, _ in BLOG_FACETS:
+        page = buildBlogQuery({column: 'Roma'}, '', None, 'date_desc', after=position)
+        checks.append((f'{column} page', page['query'], page['params'], False))
+        checks.append((f'{column} count', page['count'], page['countParams'], False))
+    search = buildBlogQuery({}, 'rome', '"rome"*', 'relevance')
+    checks.append(('search', search['query'], search['params'], True))
+    checks.append(('search count', search['count'], search['countParams'], False))
+    return checks
+
+@app.cli.command('check-queries')
+def checkQueries():
+    """Migrate the data database and show the query plan of each hot query, failing on full table scans and sorts."""
+    conn = sqlite3.connect(app.config['DATADB'])
+    version = migrateDataDB(conn)
+    click.echo(f"Data database at schema version {version}")
+
+    failures = 0
+    for name, query, params, ranked in getDataQueryChecks():
+        plan = explainQueryPlan(conn, query, params)
+        failed = [step for step in plan if re.match(r'SCAN \w+$', step)
+                  or (not ranked and step.startswith('USE TEMP B-TREE FOR'))]
+        failures += len(failed)
+        click.echo(f"{'FAIL' if failed else 'ok  '} {name}: {'; '.join(plan)}")
+    conn.close()
+    if failures:
+        raise click.ClickException(f"{failures} full table scans or sorts")
+
 if __name__ == '__main__':
     app.run(debug=True)
 
@@ -0,0 +1,2 @@
+# Benchmarks for the gallery and blog hot paths
+# Run them from the repository root, e.g. python -m bench.xmp_scan
@@ -0,0 +1,165 @@
+# ##########################################################
+# Synthetic corpus generator
+# ##########################################################
+# Builds content trees and data databases of any size for the benchmarks.
+# Folders nest depth levels deep with fanout subfolders each, and images go
+# in the leaf folders with an XMP sidecar carrying a title, description,
+# DateCreated, GPS position and dc:subject keywords, like the ones Photos
+# exports for our own pictures. Every folder gets a guide, about.txt and
+# keywords.txt. The data database gets blog posts and comments on the images.
+#
+#   python -m bench.corpus folder --images 10000 [--depth 3] [--fanout 4]
+#                                 [--posts 10000] [--comments 10000]
+import argparse
+import io
+import os
+import random
+import sqlite3
+import sys
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app as italy
+
+WORDS = (
+    'piazza duomo chiesa castello borgo collina vigna mercato fontana ponte torre palazzo '
+    'museo trattoria osteria gelato caffe mare lago montagna valle sentiero tramonto alba '
+    'medieval renaissance baroque roman etruscan gothic ancient coastal rural harbor '
+    'market festival wine olive pasta truffle cheese bread espresso basilica cloister'
+).split()
+CATEGORIES = ['Food', 'History', 'Locations', 'Art', 'Nature', 'Culture', 'Tips', 'Events']
+PROVINCES = ['Roma', 'Firenze', 'Siena', 'Perugia', 'Viterbo', 'Napoli', 'Venezia', 'Milano', 'Torino', 'Bologna',
+             'Genova', 'Pisa', 'Lucca', 'Arezzo', 'Ascoli Piceno', 'Ancona', 'Bari', 'Lecce', 'Palermo', 'Cagliari']
+AUTHORS = ['Giulia', 'Marco', 'Francesca', 'Luca', 'Chiara', 'Matteo', 'Sara', 'Andrea', 'Elena', 'Paolo']
+
+SIDECAR = """<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="XMP Core 6.0.0">
+   <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+      <rdf:Description rdf:about=""
+            xmlns:exif="http://ns.adobe.com/exif/1.0/"
+            xmlns:dc="http://purl.org/dc/elements/1.1/"
+            xmlns:photoshop="http://ns.adobe.com/photoshop/1.0/">
+         <exif:GPSLatitudeRef>N</exif:GPSLatitudeRef>
+         <exif:GPSLatitude>{latitude:.9f}</exif:GPSLatitude>
+         <exif:GPSLongitudeRef>E</exif:GPSLongitudeRef>
+         <exif:GPSLongitude>{longitude:.9f}</exif:GPSLongitude>
+         <dc:title>{title}</dc:title>
+         <dc:description>{description}</dc:description>
+         <dc:subject>
+            <rdf:Bag>
+{subjects}
+            </rdf:Bag>
+         </dc:subject>
+         <photoshop:DateCreated>{created}</photoshop:DateCreated>
+      </rdf:Description>
+   </rdf:RDF>
+</x:xmpmeta>
+"""
+
+def sentence(rng, count):
+    # Random words, capitalized
+    return ' '.join(rng.choice(WORDS) for _ in range(count)).capitalize()
+
+def tinyJpeg():
+    # A small real JPEG, written for every image so the tree stays cheap to build
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (180, 140, 90)).save(buffer, 'JPEG', quality=70)
+    return buffer.getvalue()
+
+def generateContentTree(root, images, depth=3, fanout=4, seed=1):
+    # Write a content tree with about the given number of images, returns the image keys
+    rng = random.Random(seed)
+    jpeg = tinyJpeg()
+    folders = ['']
+    for level in range(depth):
+        folders = [f"{parent}/Folder {level}-{index}".lstrip('/') for parent in folders for index in range(fanout)]
+    perFolder = max(1, -(-images // len(folders)))
+
+    keys = []
+    written = set()
+    for leaf in folders:
+        parts = leaf.split('/')
+        for level in range(len(parts) + 1):
+            folderKey = '/'.join(parts[:level])
+            if folderKey in written:
+                continue
+            written.add(folderKey)
+            fullPath = os.path.join(root, folderKey)
+            os.makedirs(fullPath, exist_ok=True)
+            name = os.path.basename(folderKey) or 'Italy'
+            with open(os.path.join(fullPath, f"{name} Guide.txt"), 'w') as f:
+                f.write(f"<p>{sentence(rng, 60)}.</p>\n<p>{sentence(rng, 40)}.</p>\n")
+            with open(os.path.join(fullPath, 'about.txt'), 'w') as f:
+                f.write(sentence(rng, 30) + '.\n')
+            with open(os.path.join(fullPath, 'keywords.txt'), 'w') as f:
+                f.write(','.join(['Italy', 'Travel'] + rng.sample(WORDS, 12)))
+
+        for index in range(min(perFolder, images - len(keys))):
+            name = f"IMG_{len(keys):06d}"
+            with open(os.path.join(root, leaf, f"{name}.jpeg"), 'wb') as f:
+                f.write(jpeg)
+            taken = datetime(2020, 1, 1) + timedelta(minutes=rng.randrange(2_000_000))
+            subjects = '\n'.join(f"               <rdf:li>{word}</rdf:li>" for word in rng.sample(WORDS, 5))
+            with open(os.path.join(root, leaf, f"{name}.xmp"), 'w') as f:
+                f.write(SIDECAR.format(
+                    latitude=rng.uniform(36.6, 47.1), longitude=rng.uniform(6.6, 18.5),
+                    title=sentence(rng, 3), description=sentence(rng, 10), subjects=subjects,
+                    created=taken.strftime('%Y-%m-%dT%H:%M:%S+01:00')
+                ))
+            keys.append(f"{leaf}/{name}.jpeg")
+    return keys
+
+def generateDataDB(path, posts, comments, imageKeys, seed=1):
+    # Write a data database with the app's schema, blog posts and comments on the given images
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    italy.migrateDataDB(conn)
+    cities = [f"{province} {suffix}" for province in PROVINCES for suffix in ('Centro', 'Nord', 'Sud')]
+
+    rows = []
+    for index in range(posts):
+        city = rng.choice(cities)
+        day = date(2018, 1, 1) + timedelta(days=rng.randrange(3000))
+        rows.append((
+            sentence(rng, 5), day.isoformat(), rng.choice(AUTHORS), rng.choice(CATEGORIES),
+            city.rsplit(' ', 1)[0], city, f"/data/images/post{index % 50}.jpg",
+            sentence(rng, 25) + '.', '\n'.join(f"<p>{sentence(rng, 40)}.</p>" for _ in range(5))
+        ))
+    conn.executemany("""
+        INSERT INTO blogs (title, date, author, category, province, city, image, excerpt, content)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+
+    # Comments follow a long tail, a few images collect most of them
+    weights = [1 / (rank + 1) for rank in range(len(imageKeys))]
+    started = datetime(2024, 1, 1)
+    conn.executemany("""
+        INSERT INTO comments (imageName, author, comment, created)
+        VALUES (?, ?, ?, ?)
+    """, [(
+        imageName, rng.choice(AUTHORS), sentence(rng, 15) + '.',
+        (started + timedelta(seconds=rng.randrange(50_000_000))).strftime('%Y-%m-%d %H:%M:%S')
+    ) for imageName in rng.choices(imageKeys, weights, k=comments)])
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic corpus generator')
+    parser.add_argument('folder', help='Where to write content/ and data.db')
+    parser.add_argument('--images', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=3, help='Folder levels below content/')
+    parser.add_argument('--fanout', type=int, default=4, help='Subfolders per folder')
+    parser.add_argument('--posts', type=int, default=None, help='Blog posts (default: as many as images)')
+    parser.add_argument('--comments', type=int, default=None, help='Comments (default: as many as images)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    contentFolder = os.path.join(args.folder, 'content')
+    keys = generateContentTree(contentFolder, args.images, args.depth, args.fanout, args.seed)
+    generateDataDB(os.path.join(args.folder, 'data.db'), args.posts if args.posts is not None else args.images,
+                   args.comments if args.comments is not None else args.images, keys, args.seed)
+    print(f"Wrote {len(keys)} images to {contentFolder} and {os.path.join(args.folder, 'data.db')}")
+
+if __name__ == '__main__':
+    main()
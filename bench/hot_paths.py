@@ -0,0 +1,197 @@
+# ##########################################################
+# Gallery and blog hot path benchmark
+# ##########################################################
+# Generates a synthetic corpus for each size (images, posts and comments
+# alike, see bench.corpus) and times the paths every page view goes through:
+#
+#   index_build        refreshContentIndex(force=True) over the whole tree
+#   metadata_cold      getImageMetadata on images never seen (sidecar parse)
+#   metadata_warm      getImageMetadata again, from the cache
+#   folder_contents    getFolderContents of a leaf folder, warm
+#   hierarchical_meta  build_hierarchical_metadata of a leaf folder
+#   blog_page          /blog, first page and a deep page by cursor
+#   blog_search        /blog?search= with ranking and snippets
+#   blog_facets        /blog with two filters, drill-down counts
+#   comments_image     /comments/<name> of the most commented image
+#   comments_counts    /comments/counts?folder= of a leaf folder
+#
+# Results are written as JSON. Pass an earlier result with --compare to
+# print the change of every median, e.g. between two commits:
+#
+#   python -m bench.hot_paths --sizes 1000 10000 100000 --output bench.json
+#   python -m bench.hot_paths --sizes 1000 --compare bench.json
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app as italy
+from bench.corpus import WORDS, generateContentTree, generateDataDB
+
+AJAX = {'X-Requested-With': 'XMLHttpRequest'}
+
+def stats(samples):
+    # Summarize timings in milliseconds
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'median_ms': round(statistics.median(samples) * 1000, 4),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 4),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 4),
+        'min_ms': round(samples[0] * 1000, 4)
+    }
+
+def timed(fn, args_list):
+    # Time fn once for each argument tuple
+    samples = []
+    for args in args_list:
+        started = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - started)
+    return stats(samples)
+
+def resetApp(folder):
+    # Point the app at a corpus and drop every per-process cache
+    italy.app.config.update(
+        CONTENT_FOLDER=os.path.join(folder, 'content'),
+        DATADB=os.path.join(folder, 'data.db'),
+        METADATADB=os.path.join(folder, 'metadata.db'),
+        DERIVATIVES_FOLDER=os.path.join(folder, 'derivatives'),
+        TESTING=True,
+        RATELIMIT_ENABLED=False,
+        MAIL_SENDER_THREAD=False
+    )
+    italy.contentIndex.update({'folders': {}, 'version': 0, 'treeVersion': 0, 'fingerprint': '', 'checked': 0.0})
+    italy.folderTree.update({'version': -1, 'nodes': {}})
+    italy.guideCache.update({'guides': {}, 'missing': {}})
+    italy.imageMetadataCache.update({'loaded': False, 'images': {}})
+    italy.folderCovers.update({'version': -1, 'candidates': {}})
+    italy.blogCache.update({'version': None, 'facets': {}, 'totals': {}})
+    italy.metadataDBLocal.__dict__.clear()
+    italy.dataDBLocal.__dict__.clear()
+    italy.dataDBState['ready'] = False
+
+def get(client, url, **kwargs):
+    # Fetch a page and insist it worked
+    response = client.get(url, **kwargs)
+    if response.status_code != 200:
+        raise SystemExit(f"{url} returned {response.status_code}")
+    return response
+
+def benchSize(size, runs, depth, fanout, workdir):
+    # Build a corpus of the given size and time every hot path on it
+    rng = random.Random(size)
+    folder = os.path.join(workdir, str(size))
+    os.makedirs(folder, exist_ok=True)
+    started = time.perf_counter()
+    keys = generateContentTree(os.path.join(folder, 'content'), size, depth, fanout)
+    generateDataDB(os.path.join(folder, 'data.db'), size, size, keys)
+    generated = time.perf_counter() - started
+    resetApp(folder)
+
+    results = {'generate_s': round(generated, 2)}
+    results['index_build'] = timed(lambda: italy.refreshContentIndex(force=True), [()] * max(1, runs // 10))
+
+    content = italy.app.config['CONTENT_FOLDER']
+    sample = [(os.path.join(content, key),) for key in rng.sample(keys, min(runs, len(keys)))]
+    results['metadata_cold'] = timed(italy.getImageMetadata, sample)
+    results['metadata_warm'] = timed(italy.getImageMetadata, sample)
+
+    leaves = sorted({key.rsplit('/', 1)[0] for key in keys})
+    leafSample = [(rng.choice(leaves),) for _ in range(runs)]
+    for leaf in set(leaf for leaf, in leafSample):
+        italy.getFolderContents(leaf)                               # Warm the metadata of the sampled folders
+    results['folder_contents'] = timed(italy.getFolderContents, leafSample)
+    results['hierarchical_meta'] = timed(italy.build_hierarchical_metadata, leafSample)
+
+    client = italy.app.test_client()
+    conn = sqlite3.connect(italy.app.config['DATADB'])
+    category, province = conn.execute("SELECT category, province FROM blogs ORDER BY id LIMIT 1").fetchone()
+    busiest = conn.execute("SELECT imageName FROM commentCounts ORDER BY count DESC LIMIT 1").fetchone()[0]
+    conn.close()
+
+    def blogPages():
+        data = get(client, '/blog', headers=AJAX).get_json()
+        for _ in range(5):
+            if not data['next_cursor']:
+                break
+            data = get(client, f"/blog/{data['page'] + 1}?after={data['next_cursor']}", headers=AJAX).get_json()
+
+    results['blog_page'] = timed(blogPages, [()] * runs)
+    results['blog_search'] = timed(lambda word: get(client, f'/blog?search={word}&sort=relevance', headers=AJAX),
+                                   [(rng.choice(WORDS)[:4],) for _ in range(runs)])
+    results['blog_facets'] = timed(lambda: get(client, '/blog', query_string={'category': category, 'province': province}, headers=AJAX),
+                                   [()] * runs)
+    results['comments_image'] = timed(lambda: get(client, f'/comments/{busiest}'), [()] * runs)
+    results['comments_counts'] = timed(lambda leaf: get(client, '/comments/counts', query_string={'folder': leaf}), leafSample)
+    return results
+
+def gitCommit():
+    # The commit being measured, if this is a git checkout
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baselinePath):
+    # Print the change of every median against an earlier run
+    with open(baselinePath) as f:
+        baseline = json.load(f)
+    print(f"Compared with {baseline.get('commit')} ({baseline.get('created')})")
+    print(f"{'size':>8} {'path':<20}{'before ms':>12}{'after ms':>12}{'change':>9}")
+    for size, paths in results['sizes'].items():
+        for name, now in paths.items():
+            before = baseline.get('sizes', {}).get(size, {}).get(name)
+            if not isinstance(now, dict) or not before:
+                continue
+            change = (now['median_ms'] / before['median_ms'] - 1) * 100 if before['median_ms'] else 0.0
+            print(f"{size:>8} {name:<20}{before['median_ms']:>12.3f}{now['median_ms']:>12.3f}{change:>+8.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description='Gallery and blog hot path benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Images, posts and comments per corpus')
+    parser.add_argument('--runs', type=int, default=50, help='Timed runs per path')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--workdir', help='Keep the generated corpora here (default: a temporary folder)')
+    parser.add_argument('--output', help='Write the JSON results here (default: stdout)')
+    parser.add_argument('--compare', help='Earlier JSON results to compare against')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)                  # Request logging would dominate the small paths
+    results = {
+        'commit': gitCommit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'runs': args.runs,
+        'depth': args.depth,
+        'fanout': args.fanout,
+        'sizes': {}
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            print(f"Benchmarking {size} items...", file=sys.stderr)
+            results['sizes'][str(size)] = benchSize(size, args.runs, args.depth, args.fanout, args.workdir or tmp)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# ##########################################################
+# Rate limit storage benchmark
+# ##########################################################
+# Compares the sqlite:// limiter storage shared by the gunicorn workers with
+# the per-worker memory:// storage:
+#
+#   - microseconds per hit for the fixed window and sliding window counter
+#     strategies, in one process, over a pool of client keys
+#   - hits per second with several processes hitting the same file at once
+#   - how many hits "5 per minute" lets through when several processes, like
+#     gunicorn workers, each take their share of the traffic
+#
+#   python -m bench.limiter [--hits 20000] [--processes 4]
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app as italy
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter, SlidingWindowCounterRateLimiter
+
+STRATEGIES = {'fixed-window': FixedWindowRateLimiter, 'sliding-window-counter': SlidingWindowCounterRateLimiter}
+
+def timeHits(uri, strategy, hits, keys):
+    # Microseconds per hit against one storage
+    limiter = STRATEGIES[strategy](storage_from_string(uri))
+    item = parse('100 per minute')
+    rng = random.Random(1)
+    clients = [f"10.0.{index // 256}.{index % 256}" for index in range(keys)]
+    for client in clients:
+        limiter.hit(item, 'bench', client)                          # Warm up, every key exists
+    started = time.perf_counter()
+    for _ in range(hits):
+        limiter.hit(item, 'bench', rng.choice(clients))
+    return (time.perf_counter() - started) / hits * 1e6
+
+def hammer(uri, strategy, seconds, results):
+    # Hit as fast as possible from one process, report the hits made
+    limiter = STRATEGIES[strategy](storage_from_string(uri))
+    item = parse('1000000 per minute')
+    rng = random.Random(os.getpid())
+    hits = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        limiter.hit(item, 'bench', f"10.0.0.{rng.randrange(256)}")
+        hits += 1
+    results.put(hits)
+
+def allowed(uri, strategy, attempts, results):
+    # Try a 5 per minute limit from one process, report the hits let through
+    limiter = STRATEGIES[strategy](storage_from_string(uri))
+    item = parse('5 per minute')
+    results.put(sum(limiter.hit(item, 'contactpage', '10.0.0.1') for _ in range(attempts)))
+
+def runProcesses(target, processes, args):
+    # Run target in forked processes, like gunicorn workers, and sum what they report
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    workers = [context.Process(target=target, args=args + (results,)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    total = sum(results.get() for _ in workers)
+    for worker in workers:
+        worker.join()
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description='Rate limit storage benchmark')
+    parser.add_argument('--hits', type=int, default=20000, help='Timed hits per storage and strategy')
+    parser.add_argument('--keys', type=int, default=1000, help='Distinct clients')
+    parser.add_argument('--processes', type=int, default=4, help='Processes sharing the storage')
+    parser.add_argument('--seconds', type=float, default=3, help='Seconds of the throughput run')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storages = {'memory': 'memory://', 'sqlite': 'sqlite://' + os.path.join(tmp, 'limits.db')}
+        print(f"{'storage':<8}{'strategy':<24}{'us/hit':>8}{'hits/s x' + str(args.processes):>14}{'5/min let through':>19}")
+        for name, uri in storages.items():
+            for strategy in STRATEGIES:
+                perHit = timeHits(uri, strategy, args.hits, args.keys)
+                throughput = runProcesses(hammer, args.processes, (uri, strategy, args.seconds)) / args.seconds
+                if name == 'sqlite':
+                    storage_from_string(uri).reset()                # Every strategy starts from empty counters
+                through = runProcesses(allowed, args.processes, (uri, strategy, 10))
+                print(f"{name:<8}{strategy:<24}{perHit:>8.1f}{throughput:>14.0f}{through:>19}")
+
+if __name__ == '__main__':
+    main()
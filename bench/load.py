@@ -0,0 +1,307 @@
+# ##########################################################
+# End-to-end load test
+# ##########################################################
+# Starts the app under gunicorn on a local port and replays a weighted mix of
+# page views at each concurrency level, then reports throughput and p50, p95
+# and p99 latency per route. Nothing outside this machine is needed.
+#
+# Routes in the mix, with their default weights:
+#
+#   home      /                                    1
+#   folder    /folder/<path>                       3
+#   blog      /blog with a filter or a search      2
+#   post      /blog/post/<id>                      2
+#   comments  /comments/<image>                    2
+#   content   /content/<image>                     4
+#
+# By default the repository's own content and data are served. --corpus N
+# serves a synthetic corpus of N images, posts and comments instead (see
+# bench.corpus). gunicorn runs with its working directory in the work folder,
+# so its italy.log, metadata, derivatives and rate limit counters stay out of
+# the repository.
+#
+# The driver shares the CPUs with gunicorn, so on a small box the numbers are
+# a floor. --url points it at a server started elsewhere instead.
+#
+#   python -m bench.load [--workers 3] [--concurrency 1 8 32] [--duration 10]
+#                        [--mix folder=5 content=5] [--corpus 10000] [--output load.json]
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, urlencode, urlsplit
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+MIX = {'home': 1, 'folder': 3, 'blog': 2, 'post': 2, 'comments': 2, 'content': 4}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+# gunicorn loads this module from the work folder, it applies the paths of
+# the served corpus before the first request
+WSGI_MODULE = """import json
+import os
+import app as italy
+
+italy.app.config.update(json.loads(os.environ['LOAD_CONFIG']))
+app = italy.app
+"""
+
+def freePort():
+    # A port nothing listens on right now
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def startServer(workdir, config, workers, threads, port):
+    # Start gunicorn on the app, returns the process once it answers
+    with open(os.path.join(workdir, 'loadapp.py'), 'w') as f:
+        f.write(WSGI_MODULE)
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join([REPO, workdir, os.environ.get('PYTHONPATH', '')]),
+               LOAD_CONFIG=json.dumps(config),
+               RATELIMIT_STORAGE_URI='sqlite://' + os.path.join(workdir, 'limits.db'),   # Never the repository's limiter database
+               MAIL_SENDER_THREAD='false')
+    command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+               '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'loadapp:app']
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'w')
+    server = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"gunicorn exited with {server.returncode}, see {log.name}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/')
+            if conn.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit(f"gunicorn did not answer on port {port}, see {log.name}")
+
+def stopServer(server):
+    # Stop gunicorn and its workers
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+def buildTargets(contentFolder, dataDB, rng):
+    # Collect the URLs of every route from the corpus being served
+    images, folders = [], []
+    for root, dirs, files in os.walk(contentFolder):
+        relative = os.path.relpath(root, contentFolder).replace(os.sep, '/')
+        if relative != '.':
+            folders.append(relative)
+        images.extend(f"{relative}/{name}" if relative != '.' else name
+                      for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+
+    conn = sqlite3.connect(dataDB)
+    posts = [row[0] for row in conn.execute("SELECT id FROM blogs")]
+    filters = conn.execute("SELECT DISTINCT category, province FROM blogs").fetchall()
+    words = [row[0].split()[0] for row in conn.execute("SELECT title FROM blogs LIMIT 200") if row[0].split()]
+    commented = [row[0] for row in conn.execute("SELECT imageName FROM comments GROUP BY imageName")]
+    conn.close()
+
+    blog = []
+    for category, province in filters:
+        blog.append('/blog?' + urlencode({'category': category}))
+        blog.append('/blog?' + urlencode({'category': category, 'province': province}))
+    blog.extend('/blog?' + urlencode({'search': word}) for word in set(words))
+
+    # Commented images are requested more often, like the modal of popular images
+    commentTargets = commented * 3 + rng.sample(images, min(len(images), 200))
+    return {
+        'home': ['/'],
+        'folder': [f"/folder/{quote(folder)}" for folder in folders],
+        'blog': blog or ['/blog'],
+        'post': [f"/blog/post/{post}" for post in posts],
+        'comments': [f"/comments/{quote(name)}" for name in commentTargets],
+        'content': [f"/content/{quote(image)}" for image in images]
+    }
+
+def percentile(ordered, fraction):
+    # Nearest rank percentile of a sorted list
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+def runLevel(host, port, targets, mix, concurrency, duration, seed):
+    # Keep concurrency clients busy for duration seconds, returns the samples per route
+    routes = [route for route in mix if targets.get(route)]
+    weights = [mix[route] for route in routes]
+    samples = {route: [] for route in routes}
+    errors = {route: 0 for route in routes}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        conn = None
+        mine = {route: [] for route in routes}
+        failed = {route: 0 for route in routes}
+        while time.monotonic() < deadline:
+            route = rng.choices(routes, weights)[0]
+            url = rng.choice(targets[route])
+            started = time.perf_counter()
+            try:
+                if conn is None:
+                    conn = http.client.HTTPConnection(host, port, timeout=30)
+                conn.request('GET', url)
+                response = conn.getresponse()
+                response.read()
+                elapsed = time.perf_counter() - started
+                if response.status >= 400:
+                    failed[route] += 1
+                else:
+                    mine[route].append(elapsed)
+                if response.will_close:                             # gunicorn sync workers close every connection
+                    conn.close()
+                    conn = None
+            except (OSError, http.client.HTTPException):
+                failed[route] += 1
+                if conn is not None:
+                    conn.close()
+                conn = None
+        with lock:
+            for route in routes:
+                samples[route].extend(mine[route])
+                errors[route] += failed[route]
+
+    started = time.monotonic()
+    clients = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return samples, errors, time.monotonic() - started
+
+def summarize(samples, errors, elapsed):
+    # Throughput and latency percentiles per route and for the whole mix
+    summary = {}
+    everything = []
+    for route, latencies in samples.items():
+        everything.extend(latencies)
+        summary[route] = summarizeRoute(sorted(latencies), errors[route], elapsed)
+    summary['all'] = summarizeRoute(sorted(everything), sum(errors.values()), elapsed)
+    return summary
+
+def summarizeRoute(ordered, errors, elapsed):
+    # One row of the report from sorted latencies
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'rps': round(len(ordered) / elapsed, 1),
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 2)
+    }
+
+def printLevel(concurrency, summary):
+    # Print the report of one concurrency level
+    print(f"\nConcurrency {concurrency}")
+    print(f"{'route':<10}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, row in summary.items():
+        print(f"{route:<10}{row['requests']:>10}{row['errors']:>8}{row['rps']:>10.1f}"
+              f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}")
+
+def parseMix(pairs):
+    # route=weight pairs, routes left out keep no weight
+    if not pairs:
+        return dict(MIX)
+    mix = {}
+    for pair in pairs:
+        route, _, weight = pair.partition('=')
+        if route not in MIX or not weight:
+            raise SystemExit(f"Unknown mix entry {pair}, routes are {', '.join(MIX)}")
+        mix[route] = float(weight)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end load test under gunicorn')
+    parser.add_argument('--workers', type=int, default=(os.cpu_count() or 1) * 2 + 1, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=1, help='Threads per gunicorn worker')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32], help='Clients per level')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per level')
+    parser.add_argument('--warmup', type=float, default=3, help='Seconds of traffic before the first level')
+    parser.add_argument('--mix', nargs='+', help='route=weight pairs, e.g. folder=5 content=5')
+    parser.add_argument('--corpus', type=int, help='Serve a synthetic corpus of this size')
+    parser.add_argument('--workdir', help='Work folder (default: a temporary folder)')
+    parser.add_argument('--url', help='Load a server that is already running instead of starting one')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Also write the results as JSON here')
+    args = parser.parse_args()
+
+    mix = parseMix(args.mix)
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = os.path.abspath(args.workdir or tmp)
+        os.makedirs(workdir, exist_ok=True)
+        if args.corpus:
+            from bench.corpus import generateContentTree, generateDataDB
+            print(f"Generating a corpus of {args.corpus}...", file=sys.stderr)
+            contentFolder = os.path.join(workdir, 'content')
+            dataDB = os.path.join(workdir, 'data.db')
+            keys = generateContentTree(contentFolder, args.corpus)
+            generateDataDB(dataDB, args.corpus, args.corpus, keys)
+        else:
+            contentFolder = os.path.join(REPO, 'content')
+            dataDB = os.path.join(workdir, 'data.db')
+            with sqlite3.connect(os.path.join(REPO, 'data', 'data.db')) as source, sqlite3.connect(dataDB) as copy:
+                source.backup(copy)                                 # Comments posted by the app never touch the real database
+        targets = buildTargets(contentFolder, dataDB, rng)
+
+        server = None
+        if args.url:
+            parts = urlsplit(args.url)
+            host, port = parts.hostname, parts.port or 80
+        else:
+            host, port = '127.0.0.1', freePort()
+            config = {
+                'CONTENT_FOLDER': contentFolder,
+                'DATADB': dataDB,
+                'METADATADB': os.path.join(workdir, 'metadata.db'),
+                'DERIVATIVES_FOLDER': os.path.join(workdir, 'derivatives')
+            }
+            print(f"Starting gunicorn with {args.workers} workers on port {port}...", file=sys.stderr)
+            server = startServer(workdir, config, args.workers, args.threads, port)
+
+        results = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'workers': None if args.url else args.workers,
+            'threads': None if args.url else args.threads,
+            'corpus': args.corpus,
+            'duration': args.duration,
+            'mix': mix,
+            'levels': {}
+        }
+        try:
+            if args.warmup:
+                runLevel(host, port, targets, mix, max(args.concurrency), args.warmup, args.seed)
+            for concurrency in args.concurrency:
+                samples, errors, elapsed = runLevel(host, port, targets, mix, concurrency, args.duration, args.seed)
+                summary = summarize(samples, errors, elapsed)
+                results['levels'][str(concurrency)] = summary
+                printLevel(concurrency, summary)
+        finally:
+            if server is not None:
+                stopServer(server)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# ##########################################################
+# Embedded XMP scan benchmark
+# ##########################################################
+# Compares the bytes read per image by the old embedded-XMP fallback, which
+# read the whole file, with the JPEG segment walk in readEmbeddedXmp.
+#
+# Our own photos keep their metadata in sidecars, so each JPEG is also copied
+# with an XMP APP1 segment spliced in after an EXIF-sized APP1 segment, which
+# is where cameras and Photos put it.
+#
+#   python -m bench.xmp_scan [folder] [--limit N]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app as italy
+
+SAMPLE_XMP = (
+    b'<?xpacket begin="\xef\xbb\xbf" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+    b'<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+    b'<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+    b'<dc:title><rdf:Alt><rdf:li xml:lang="x-default">Bench Title</rdf:li></rdf:Alt></dc:title>'
+    b'<dc:description><rdf:Alt><rdf:li xml:lang="x-default">Bench Description</rdf:li></rdf:Alt></dc:description>'
+    b'</rdf:Description></rdf:RDF></x:xmpmeta><?xpacket end="w"?>'
+)
+
+class CountingFile:
+    # Wraps a binary file and counts the bytes actually read from it
+    def __init__(self, f):
+        self.f = f
+        self.bytesRead = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.bytesRead += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.f.seek(offset, whence)
+
+def segment(marker, payload):
+    # Build one JPEG segment
+    return b'\xff' + bytes([marker]) + (len(payload) + 2).to_bytes(2, 'big') + payload
+
+def withEmbeddedXmp(data):
+    # Copy of a JPEG with a 60 KB EXIF-like APP1 segment and an XMP APP1 segment
+    exif = segment(0xE1, b'Exif\x00\x00' + b'\x00' * 60000)
+    xmp = segment(0xE1, italy.XMP_APP1_HEADER + SAMPLE_XMP)
+    return data[:2] + exif + xmp + data[2:]
+
+def oldScan(path):
+    # The previous fallback: read the whole image and search it
+    with open(path, 'rb') as f:
+        data = f.read()
+    start = data.find(italy.XMP_START)
+    end = data.find(italy.XMP_END)
+    return len(data), (data[start:end+len(italy.XMP_END)] if start != -1 and end != -1 else None)
+
+def newScan(path):
+    # The segment walk, through a byte counter
+    with open(path, 'rb') as f:
+        counter = CountingFile(f)
+        packet = italy.scanJpegXmp(counter)
+    return counter.bytesRead, packet
+
+def main():
+    parser = argparse.ArgumentParser(description='Embedded XMP scan benchmark')
+    parser.add_argument('folder', nargs='?', default=italy.app.config['CONTENT_FOLDER'])
+    parser.add_argument('--limit', type=int, default=200, help='Maximum number of JPEGs to sample')
+    args = parser.parse_args()
+
+    images = []
+    for root, _, files in os.walk(args.folder):
+        images.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(('.jpg', '.jpeg')))
+    images = sorted(images)[:args.limit]
+    if not images:
+        print(f"No JPEGs found under {args.folder}")
+        return
+
+    results = {'plain': [0, 0, 0.0, 0.0], 'embedded': [0, 0, 0.0, 0.0]}     # old bytes, new bytes, old secs, new secs
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, path in enumerate(images):
+            embeddedPath = os.path.join(tmp, f"{i}.jpeg")
+            with open(path, 'rb') as src, open(embeddedPath, 'wb') as dst:
+                dst.write(withEmbeddedXmp(src.read()))
+
+            for kind, target in (('plain', path), ('embedded', embeddedPath)):
+                started = time.perf_counter()
+                oldBytes, oldPacket = oldScan(target)
+                results[kind][2] += time.perf_counter() - started
+
+                started = time.perf_counter()
+                newBytes, newPacket = newScan(target)
+                results[kind][3] += time.perf_counter() - started
+
+                if kind == 'embedded' and (oldPacket is None or newPacket is None or oldPacket not in newPacket):
+                    raise SystemExit(f"Segment walk missed the XMP packet in {path}")
+                results[kind][0] += oldBytes
+                results[kind][1] += newBytes
+
+    print(f"{len(images)} JPEGs sampled from {args.folder}")
+    print(f"{'':<10}{'old bytes/image':>18}{'new bytes/image':>18}{'old ms/image':>15}{'new ms/image':>15}")
+    for kind, (oldBytes, newBytes, oldSecs, newSecs) in results.items():
+        print(f"{kind:<10}{oldBytes / len(images):>18,.0f}{newBytes / len(images):>18,.0f}"
+              f"{oldSecs * 1000 / len(images):>15.3f}{newSecs * 1000 / len(images):>15.3f}")
+
+if __name__ == '__main__':
+    main()
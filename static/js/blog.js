@@ -278,6 +278,11 @@ class BlogManager {
         const searchInput = document.getElementById("search");
         searchInput.value = searchTerm;
 
+        // Rank search results by relevance unless another order was chosen
+        if (searchTerm.trim() && this.sortSelect && this.sortSelect.value === 'date_desc') {
+            this.sortSelect.value = 'relevance';
+        }
+
         // Submit the form
         await this.submitFormWithAjax();
     }
@@ -300,6 +305,11 @@ class BlogManager {
         // Update results info
         this.updateResultsInfo(data.total_posts, data.filters);
 
+        // Update filter counts for the active filters
+        if (data.facets) {
+            this.updateFacets(data.facets);
+        }
+
         // Re-attach event listeners to new posts
         this.attachPostClickHandlers();
 
@@ -307,6 +317,32 @@ class BlogManager {
         this.blogGrid.scrollIntoView({ behavior: 'smooth', block: 'start' });
     }
 
+    updateFacets(facets) {
+        const selects = {
+            category: ['categories', 'All Categories'],
+            province: ['provinces', 'All Provinces'],
+            city: ['cities', 'All Cities'],
+            author: ['authors', 'All Authors']
+        };
+
+        Object.entries(selects).forEach(([id, [name, allLabel]]) => {
+            const select = document.getElementById(id);
+            if (!select || !facets[name]) return;
+
+            const current = select.value;
+            const options = facets[name].slice();
+            if (current && !options.some(option => option.name === current)) {
+                options.push({ name: current, count: 0 });
+            }
+
+            select.innerHTML = `<option value="">${allLabel}</option>` + options.map(option => `
+                <option value="${this.escapeHtml(option.name)}" ${option.name === current ? 'selected' : ''}>
+                    ${this.escapeHtml(option.name)} (${option.count})
+                </option>
+            `).join('');
+        });
+    }
+
     updateBlogGrid(posts) {
         if (!posts || posts.length === 0) {
             this.blogGrid.innerHTML = `
@@ -339,7 +375,7 @@ class BlogManager {
                         </span>
                         ${post.category ? `<span class="post-meta-item">in ${this.escapeHtml(post.category)}</span>` : ''}
                     </div>
-                    <div class="post-excerpt">${this.escapeHtml(post.excerpt)}</div>
+                    <div class="post-excerpt">${post.snippet || this.escapeHtml(post.excerpt)}</div>
                     <div class="post-tags">
                         ${post.category ? `<span class="post-tag">${this.escapeHtml(post.category)}</span>` : ''}
                         ${post.province ? `<span class="post-tag">${this.escapeHtml(post.province)}</span>` : ''}
@@ -428,6 +464,14 @@ class BlogManager {
                     }
                     params.set('page', pageParam);
 
+                    // Keep the keyset cursor of next/previous links
+                    ['after', 'before'].forEach(key => {
+                        const cursor = url.searchParams.get(key);
+                        if (cursor) {
+                            params.set(key, cursor);
+                        }
+                    });
+
                     // Make AJAX request for pagination
                     await this.loadPostsWithParams(params);
                 }
@@ -42,6 +42,30 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 });
 
+// Comment badges for the whole folder grid, in one request
+document.addEventListener('DOMContentLoaded', () => {
+    const grid = document.querySelector('.image-grid[data-folder]');
+    if (!grid) return;
+
+    fetch(`/comments/counts?folder=${encodeURIComponent(grid.getAttribute('data-folder'))}`)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) return;
+            grid.querySelectorAll('.image-item').forEach(item => {
+                const counts = data.counts[item.getAttribute('data-path')];
+                const thumbnail = item.querySelector('.image-thumbnail');
+                if (!counts || !counts.count || !thumbnail) return;
+
+                const badge = document.createElement('span');
+                badge.className = 'comment-badge';
+                badge.textContent = counts.count;
+                badge.title = `${counts.count} comment${counts.count === 1 ? '' : 's'}`;
+                thumbnail.appendChild(badge);
+            });
+        })
+        .catch(error => console.error('Failed to load comment counts:', error));
+});
+
 // Privacy Popup
 let popupLoaded = false;
 
@@ -397,7 +421,7 @@ class PhotoGallery {
         const imageModal = document.getElementById('imageModal');
 
         if (modalImage && imgTag) {
-            this.loadImageIntoModal(imgTag.src);
+            this.loadImageIntoModal(imgEl.getAttribute('data-full') || imgTag.src);
             modalImage.setAttribute('data-image-name', imagePath);
             modalImage.setAttribute('image-title', fullTitle);
         }
@@ -467,7 +491,7 @@ class PhotoGallery {
         const imageTitle = document.getElementById('imageTitle');
 
         if (modalImage && imgTag) {
-            this.loadImageIntoModal(imgTag.src);
+            this.loadImageIntoModal(imgEl.getAttribute('data-full') || imgTag.src);
             modalImage.setAttribute('data-image-name', imagePath);
             modalImage.setAttribute('image-title', fullTitle);
         }
@@ -714,7 +738,7 @@ function openImageModal(imgEl) {
     const imageModal = document.getElementById('imageModal');
 
     if (modalImage && imgTag) {
-        loadImageIntoModal(imgTag.src);
+        loadImageIntoModal(imgEl.getAttribute('data-full') || imgTag.src);
         // Store the full relative path as the image name for comments
         modalImage.setAttribute('data-image-name', imagePath);
         modalImage.setAttribute('image-title', fullTitle);